@@ -1,3 +1,6 @@
+import math
+from collections import OrderedDict
+
 import numpy as np
 from hierarch import numba_overloads
 import numba as nb
@@ -50,8 +53,9 @@ def nb_data_grabber(data, col: int, treatment_labels):
 def nb_unique(input_data, axis=0):
     """Numba-accelerated 2D np.unique(a, return_index=True, return_counts=True)
 
-    Appears to asymptotically approach np.unique's speed
-    when every row is unique, but otherwise runs faster.
+    Runs in linear time. Lexicographically sorted input, which is the usual
+    case for hierarch's design matrices, is grouped in a single pass. Other
+    input is grouped by hashing and only the unique rows are sorted.
 
     Parameters
     ----------
@@ -71,38 +75,144 @@ def nb_unique(input_data, axis=0):
         number of instances of each unique row
     """
 
-    # don't want to sort original data
     if axis == 1:
-        data = input_data.T.copy()
+        data = input_data.T
 
     else:
-        data = input_data.copy()
+        data = input_data
+
+    if _is_lexsorted(data):
+        idx = _sorted_group_starts(data)
+        counts = np.append(idx[1:], data.shape[0]) - idx
 
-    # so we can remember the original indexes of each row
-    orig_idx = np.array([i for i in range(data.shape[0])])
+    else:
+        idx, counts = _hashed_groups(data)
 
-    # sort our data AND the original indexes
-    for i in range(data.shape[1] - 1, -1, -1):
-        sorter = data[:, i].argsort(kind="mergesort")
+        # only the unique rows need to be sorted. mergesort to keep
+        # associations
+        order = np.arange(idx.size)
+        for i in range(data.shape[1] - 1, -1, -1):
+            sorter = data[idx[order], i].argsort(kind="mergesort")
+            order = order[sorter]
+        idx = idx[order]
+        counts = counts[order]
 
-        # mergesort to keep associations
-        data = data[sorter]
-        orig_idx = orig_idx[sorter]
-    # get original indexes
-    idx = [0]
+    return data[idx], idx, counts
 
-    if data.shape[1] > 1:
-        bool_idx = ~np.all((data[:-1] == data[1:]), axis=1)
-        additional_uniques = np.nonzero(bool_idx)[0] + 1
 
-    else:
-        additional_uniques = np.nonzero(~(data[:-1] == data[1:]))[0] + 1
+@nb.jit(nopython=True, cache=True)
+def _is_lexsorted(data):
+    """Checks whether the rows of a 2D array are in lexicographic order."""
+    for i in range(1, data.shape[0]):
+        for j in range(data.shape[1]):
+            if data[i - 1, j] < data[i, j]:
+                break
+            if data[i - 1, j] > data[i, j]:
+                return False
+    return True
+
+
+@nb.jit(nopython=True, cache=True)
+def _sorted_group_starts(data):
+    """Returns the index of the first row of each run of identical rows."""
+    starts = np.empty(data.shape[0], dtype=np.int64)
+    if data.shape[0] == 0:
+        return starts
+    starts[0] = 0
+    n_groups = 1
+    for i in range(1, data.shape[0]):
+        for j in range(data.shape[1]):
+            if data[i - 1, j] != data[i, j]:
+                starts[n_groups] = i
+                n_groups += 1
+                break
+    return starts[:n_groups]
+
+
+@nb.jit(nopython=True, cache=True)
+def _hashed_groups(data):
+    """Groups identical rows of a 2D array in linear time.
+
+    Returns the index of the first instance of each unique row and the
+    number of instances, in order of first appearance.
+    """
+    n = data.shape[0]
+    ids = np.zeros(n, dtype=np.int64)
+    n_groups = 1 if n > 0 else 0
+
+    # refine the groups one column at a time. a group is identified by its
+    # group in the previous columns and a code for its value in this column
+    for j in range(data.shape[1]):
+        codes, n_codes = _value_codes(data[:, j])
+        for i in range(n):
+            ids[i] = ids[i] * n_codes + codes[i]
+        n_groups = _dense_relabel(ids, n_groups * n_codes)
+
+    first = np.full(n_groups, -1, dtype=np.int64)
+    counts = np.zeros(n_groups, dtype=np.int64)
+    for i in range(n):
+        if first[ids[i]] == -1:
+            first[ids[i]] = i
+        counts[ids[i]] += 1
+    return first, counts
 
-    idx = np.append(idx, additional_uniques)
-    # get counts for each unique row
-    counts = np.append(idx[1:], data.shape[0])
-    counts = counts - idx
-    return data[idx], orig_idx[idx], counts
+
+@nb.jit(nopython=True, cache=True)
+def _value_codes(column):
+    """Codes the values of a 1D array as integers in [0, n_codes)."""
+    n = column.size
+    codes = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return codes, 1
+
+    # design columns are usually integer labels, which can be offset directly
+    low, high = column.min(), column.max()
+    integral = high - low <= 4 * n
+    for i in range(n):
+        if column[i] != np.floor(column[i]):
+            integral = False
+            break
+
+    if integral:
+        for i in range(n):
+            codes[i] = np.int64(column[i] - low)
+        return codes, np.int64(high - low) + 1
+
+    value_codes = nb.typed.Dict.empty(
+        key_type=nb.types.float64, value_type=nb.types.int64
+    )
+    for i in range(n):
+        v = column[i]
+        if v not in value_codes:
+            value_codes[v] = len(value_codes)
+        codes[i] = value_codes[v]
+    return codes, len(value_codes)
+
+
+@nb.jit(nopython=True, cache=True)
+def _dense_relabel(keys, n_keys):
+    """Relabels integer keys in [0, n_keys) in place as 0, 1, 2... in order of
+    first appearance. Returns the number of distinct keys.
+    """
+    n_labels = 0
+    if n_keys <= 4 * keys.size:
+        labels = np.full(n_keys, -1, dtype=np.int64)
+        for i in range(keys.size):
+            if labels[keys[i]] == -1:
+                labels[keys[i]] = n_labels
+                n_labels += 1
+            keys[i] = labels[keys[i]]
+
+    else:
+        hashed_labels = nb.typed.Dict.empty(
+            key_type=nb.types.int64, value_type=nb.types.int64
+        )
+        for i in range(keys.size):
+            if keys[i] not in hashed_labels:
+                hashed_labels[keys[i]] = n_labels
+                n_labels += 1
+            keys[i] = hashed_labels[keys[i]]
+    return n_labels
 
 
 @nb.jit(nopython=True)
@@ -148,6 +258,49 @@ def bivar_central_moment(x, y, pow=1, ddof=1):
     return moment
 
 
+@nb.jit(nopython=True, cache=True)
+def bivar_central_sums(x, y):
+    """Computes every central sum needed to studentize a covariance.
+
+    Two-pass algorithm for stability, like bivar_central_moment, but the
+    second pass accumulates all of the sums at once. Dividing a sum by
+    (n - ddof) gives the bivar_central_moment with that ddof.
+
+    Parameters
+    ----------
+    x, y : 1D array-likes
+        x and y values to be compared
+
+    Returns
+    -------
+    sum_xy : float64
+        Sum of products of deviations, (x - mean_x) * (y - mean_y).
+    sum_x2y2 : float64
+        Sum of products of squared deviations.
+    sum_xx, sum_yy : float64
+        Sums of squared deviations of x and y.
+    """
+    n = len(x)
+
+    mean_x = mean_y = 0
+    for i in range(n):
+        mean_x += x[i]
+        mean_y += y[i]
+    mean_x /= n
+    mean_y /= n
+
+    sum_xy = sum_x2y2 = sum_xx = sum_yy = 0
+    for x_, y_ in zip(x, y):
+        dev_x = x_ - mean_x
+        dev_y = y_ - mean_y
+        sum_xy += dev_x * dev_y
+        sum_x2y2 += (dev_x**2) * (dev_y**2)
+        sum_xx += dev_x * dev_x
+        sum_yy += dev_y * dev_y
+
+    return sum_xy, sum_x2y2, sum_xx, sum_yy
+
+
 @nb.jit(nopython=True, cache=True)
 def _repeat(target, counts):
     return np.repeat(np.array(target), counts)
@@ -272,8 +425,8 @@ def weights_to_index(weights):
 def msp(items):
     """Yield the permutations of `items`
 
-    items is either a list of integers representing the actual items or a list of hashable items.
-    The output are the unique permutations of the items.
+    items is a sequence of numbers. The output are the unique permutations of
+    the items, generated by the compiled enumerator in nb_msp_fill.
 
     Parameters
     ----------
@@ -291,72 +444,414 @@ def msp(items):
     Tadao Takaoka.
     https://pdfs.semanticscholar.org/83b2/6f222e8648a7a0599309a40af21837a0264b.pdf
 
-    Taken from @smichr
+    Adapted from @smichr
     """
-    E = list(reversed(sorted([i for i in items])))
-
-    def visit(head):
-        (rv, j) = ([], head)
-        for i in range(N):
-            (dat, j) = E[j]
-            rv.append(dat)
-        return rv
-
-    N = len(E)
-    # put E into linked-list format
-    (val, nxt) = (0, 1)
-    for i in range(N):
-        E[i] = [E[i], i + 1]
-    E[-1][nxt] = None
-    head = 0
-    afteri = N - 1
-    i = afteri - 1
-    yield visit(head)
-
-    while E[afteri][nxt] is not None or E[afteri][val] < E[head][val]:
-        j = E[afteri][nxt]  # added to algorithm for clarity
-        if j is not None and E[i][val] >= E[j][val]:
-            beforek = afteri
-        else:
-            beforek = i
-        k = E[beforek][nxt]
-        E[beforek][nxt] = E[k][nxt]
-        E[k][nxt] = head
-        if E[k][val] < E[head][val]:
-            i = k
-        afteri = E[i][nxt]
-        head = k
-        yield visit(head)
+    items = np.asarray(items)
+    stratification = np.array([0, items.size])
+    val, nxt, state = msp_state(items, stratification)
+    row = np.empty((1, val.size), dtype=val.dtype)
+    while nb_msp_fill(val, nxt, state, stratification, row) == 0:
+        yield row[0].tolist()
+    yield row[0].tolist()
+
+
+def n_multiset_permutations(items, stratification):
+    """Count the distinct stratified permutations of items.
+
+    Parameters
+    ----------
+    items : 1D array-like
+    stratification : 1D array-like
+        Ranges to permute within. Must be sorted.
+
+    Returns
+    -------
+    int
+        Product over strata of the number of distinct permutations of the
+        items in each stratum.
+    """
+    total = 1
+    for v, w in zip(stratification[:-1], stratification[1:]):
+        placed = 0
+        for count in np.unique(items[v:w], return_counts=True)[1]:
+            placed += int(count)
+            total *= math.comb(placed, int(count))
+    return total
+
+
+@nb.jit(nopython=True, cache=True)
+def msp_state(items, stratification):
+    """Set up the state of a stratified multiset permutation enumerator.
+
+    Parameters
+    ----------
+    items : 1D array
+    stratification : 1D array of ints
+        Ranges to permute within. Must be sorted.
+
+    Returns
+    -------
+    val : 1D array
+        items in descending order within each stratum, which is also the
+        first permutation.
+    nxt : 1D array of ints
+        Linked list over each stratum of val. -1 marks the end of a list.
+    state : 2D array of ints
+        Head of the list and Takaoka's i and afteri pointers for each stratum.
+    """
+    val = items.copy()
+    nxt = np.empty(val.size, dtype=np.int64)
+    state = np.empty((stratification.size - 1, 3), dtype=np.int64)
+    for s in range(stratification.size - 1):
+        v, w = stratification[s], stratification[s + 1]
+        val[v:w] = np.sort(items[v:w])[::-1]
+        _msp_reset(nxt, state[s], v, w)
+    return val, nxt, state
+
+
+@nb.jit(nopython=True, cache=True)
+def _msp_reset(nxt, state, v, w):
+    for i in range(v, w):
+        nxt[i] = i + 1
+    nxt[w - 1] = -1
+    state[0] = v
+    state[1] = w - 2
+    state[2] = w - 1
+
+
+@nb.jit(nopython=True, cache=True)
+def _msp_step(val, nxt, state, v, w):
+    """Advance one stratum to its next permutation. Returns True if every
+    permutation has been visited and the stratum started over."""
+    head, i, afteri = state[0], state[1], state[2]
+    j = nxt[afteri]
+    if j == -1 and val[afteri] >= val[head]:
+        _msp_reset(nxt, state, v, w)
+        return True
+
+    if j != -1 and val[i] >= val[j]:
+        beforek = afteri
+    else:
+        beforek = i
+    k = nxt[beforek]
+    nxt[beforek] = nxt[k]
+    nxt[k] = head
+    if val[k] < val[head]:
+        i = k
+    state[0] = k
+    state[1] = i
+    state[2] = nxt[i]
+    return False
+
+
+@nb.jit(nopython=True, cache=True)
+def nb_msp_fill(val, nxt, state, stratification, out):
+    """Fill each row of out with the next stratified permutation of a multiset.
+
+    Each stratum is visited in the same order as Takaoka's loopless
+    algorithm, and strata are combined like an odometer, with the last
+    stratum changing fastest. When every permutation has been visited, the
+    enumerator starts over from the first one.
+
+    Parameters
+    ----------
+    val, nxt, state : arrays
+        Enumerator from msp_state. Modified in place.
+    stratification : 1D array of ints
+        Same ranges that were passed to msp_state.
+    out : 2D array
+        Array of shape (k, val.size) to write permutations to.
+
+    Returns
+    -------
+    int
+        Number of times the enumerator started over.
+    """
+    laps = 0
+    for row in range(out.shape[0]):
+        for s in range(stratification.size - 1):
+            j = state[s, 0]
+            for col in range(stratification[s], stratification[s + 1]):
+                out[row, col] = val[j]
+                j = nxt[j]
+
+        # carry into the previous stratum whenever one starts over
+        s = stratification.size - 2
+        while s >= 0 and _msp_step(
+            val, nxt, state[s], stratification[s], stratification[s + 1]
+        ):
+            s -= 1
+        if s < 0:
+            laps += 1
+
+    return laps
+
+
+class Hierarchy:
+    """Cluster structure of a lexicographically sorted design matrix.
+
+    Identifies every cluster in one linear pass so that Bootstrapper,
+    GroupbyMean and Permuter do not each rediscover the same structure.
+    Build one per design and pass it to their fit() methods.
+
+    Parameters
+    ----------
+    data : 2D numeric array
+        Lexicographically sorted data. The final column is the dependent
+        variable and is ignored.
+
+    Attributes
+    ----------
+    n_levels : int
+        Number of design columns.
+    n_rows : int
+        Number of rows in data.
+    offsets : list of 1D arrays of ints
+        offsets[i] holds the first row of each distinct combination of the
+        first i columns, followed by the number of rows.
+    uniques : list of 2D arrays
+        uniques[i] holds each distinct combination of the first i columns.
+    parents : list of 1D arrays of ints
+        parents[i] is the index in uniques[i - 1] of the parent of each row of
+        uniques[i]. parents[0] is empty.
+    cluster_counts : list of 1D arrays of ints
+        cluster_counts[i] is the number of distinct values of column i within
+        each cluster of column i - 1, where every row counts as a distinct
+        value of the final column. Equivalent to id_cluster_counts.
+
+    Examples
+    --------
+    >>> data = np.array([[1, 1, 1, 0.5],
+    ...                  [1, 1, 2, 0.2],
+    ...                  [1, 2, 1, 0.7],
+    ...                  [2, 1, 1, 0.1]])
+    >>> hierarchy = Hierarchy(data)
+    >>> hierarchy.cluster_counts
+    [array([2]), array([2, 1]), array([2, 1, 1])]
+    >>> hierarchy.offsets[2]
+    array([0, 2, 3, 4])
+
+    collapse() describes the data after aggregating the final column.
+
+    >>> hierarchy.collapse(1).cluster_counts
+    [array([2]), array([2, 1])]
+
+    matches() checks that a Hierarchy describes some other data.
+
+    >>> hierarchy.matches(data[::-1])
+    False
+    """
+
+    def __init__(self, data):
+        design = data[:, :-1]
+        if not _is_lexsorted(design):
+            raise ValueError("Hierarchy requires lexicographically sorted data.")
+
+        first_difference = _first_difference(design)
+        self.n_rows, self.n_levels = design.shape
+
+        self.offsets = [
+            np.append(np.flatnonzero(first_difference < i), self.n_rows)
+            for i in range(self.n_levels + 1)
+        ]
+        self.uniques = [
+            design[offsets[:-1], :i] for i, offsets in enumerate(self.offsets)
+        ]
+        self._link()
+
+        # rows are the subclusters of the final column, even if some are
+        # identical
+        self.cluster_counts[-1] = np.diff(self.offsets[-2])
+
+    def _link(self):
+        """Derives parents and cluster_counts from offsets."""
+        self.parents = [np.empty(0, dtype=np.int64)]
+        for i in range(1, self.n_levels + 1):
+            self.parents.append(
+                np.searchsorted(
+                    self.offsets[i - 1][:-1], self.offsets[i][:-1], side="right"
+                )
+                - 1
+            )
+        self.cluster_counts = [
+            np.bincount(self.parents[i + 1], minlength=self.offsets[i].size - 1)
+            for i in range(self.n_levels)
+        ]
+
+    def collapse(self, iterations=1):
+        """Hierarchy of the data after GroupbyMean.transform(iterations).
+
+        Parameters
+        ----------
+        iterations : int, optional
+            Number of reductions, by default 1
+
+        Returns
+        -------
+        Hierarchy
+        """
+        if iterations == 0:
+            return self
+
+        collapsed = Hierarchy.__new__(Hierarchy)
+        collapsed.n_levels = self.n_levels - iterations
+        rows = self.offsets[collapsed.n_levels][:-1]
+        collapsed.n_rows = rows.size
+        collapsed.offsets = [
+            np.searchsorted(rows, offsets)
+            for offsets in self.offsets[: collapsed.n_levels + 1]
+        ]
+        collapsed.uniques = self.uniques[: collapsed.n_levels + 1]
+        collapsed._link()
+        return collapsed
+
+    def matches(self, data):
+        """Whether this Hierarchy describes the design of data.
+
+        Parameters
+        ----------
+        data : 2D numeric array
+
+        Returns
+        -------
+        bool
+        """
+        design = data[:, :-1]
+        if design.shape != (self.n_rows, self.n_levels):
+            return False
+        # every row must equal the unique row of the cluster it falls in
+        return np.array_equal(
+            np.repeat(self.uniques[-1], np.diff(self.offsets[-1]), axis=0), design
+        )
+
+    def labels(self, column):
+        """Value of a column for each of its clusters, such as the treatment
+        applied to each treated unit.
+
+        Parameters
+        ----------
+        column : int
+
+        Returns
+        -------
+        1D array
+        """
+        return self.uniques[column + 1][:, column]
+
+
+@nb.jit(nopython=True, cache=True)
+def _first_difference(design):
+    """Index of the first column in which each row of a 2D array differs from
+    the previous row. -1 for the first row, number of columns for repeats.
+    """
+    first = np.empty(design.shape[0], dtype=np.int64)
+    if design.shape[0] > 0:
+        first[0] = -1
+    for i in range(1, design.shape[0]):
+        first[i] = design.shape[1]
+        for j in range(design.shape[1]):
+            if design[i - 1, j] != design[i, j]:
+                first[i] = j
+                break
+    return first
 
 
 class GroupbyMean:
     """Class for performing groupby reductions on numpy arrays.
 
     Currently only supports mean reduction.
+
+    Parameters
+    ----------
+    cache_size : int, optional
+        Maximum number of reduceat offsets to keep, by default 50. The least
+        recently used offsets are evicted first.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of reductions since the last fit() whose offsets were or were not
+        found in the cache.
     """
 
-    def __init__(self):
-        self.cache_dict = {}
+    def __init__(self, cache_size=50):
+        self.cache_size = cache_size
+        self.cache_dict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-    def fit(self, reference_data):
+    def fit(self, reference_data, hierarchy=None):
         """Fits the class to reference data.
 
         Parameters
         ----------
         reference_data : 2D numeric numpy array
             Reference data to use for the reduction.
+        hierarchy : Hierarchy, optional
+            Precomputed Hierarchy of reference_data, by default None
 
         """
         self.reference_dict = {}
 
-        reference = reference_data[:, :-1]
+        if hierarchy is not None:
+            for i in reversed(range(1, hierarchy.n_levels)):
+                self.reference_dict[i] = (
+                    hierarchy.uniques[i],
+                    hierarchy.cluster_counts[i],
+                )
+
+        else:
+            reference = reference_data[:, :-1]
+
+            for i in reversed(range(1, reference.shape[1])):
+                reference, counts = nb_unique(reference[:, :-1])[0::2]
 
-        for i in reversed(range(1, reference.shape[1])):
-            reference, counts = nb_unique(reference[:, :-1])[0::2]
+                self.reference_dict[i] = (reference, counts.astype(np.int64))
 
-            self.reference_dict[i] = (reference, counts.astype(np.int64))
+        self.n_columns = reference_data.shape[1]
+        self.cache_dict.clear()
+        self.hits = 0
+        self.misses = 0
 
-    def transform(self, target, iterations=1):
+    def fixed_offsets(self, iterations=1):
+        """Precomputes the reduceat offsets for the fitted reference design.
+
+        Valid for any target whose design columns are identical to the
+        reference data, such as the output of a "weights" or "bayesian"
+        bootstrap. See nb_groupby_mean.
+
+        Parameters
+        ----------
+        iterations : int, optional
+            Number of reductions to perform, by default 1
+
+        Returns
+        -------
+        offsets, counts, bounds : 1D arrays of ints
+            Concatenated reduceat offsets and group sizes for each reduction, and
+            the boundaries of each reduction within them.
+        """
+        offsets, counts, bounds = [], [], [0]
+        for column in range(self.n_columns - 2, self.n_columns - 2 - iterations, -1):
+            level_counts = self.reference_dict[column][1]
+            counts.append(level_counts)
+            offsets.append(np.cumsum(level_counts) - level_counts)
+            bounds.append(bounds[-1] + level_counts.size)
+
+        if iterations == 0:
+            return (
+                np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64),
+                np.array(bounds, dtype=np.int64),
+            )
+
+        return (
+            np.concatenate(offsets),
+            np.concatenate(counts),
+            np.array(bounds, dtype=np.int64),
+        )
+
+    def transform(self, target, iterations=1, weights=None):
         """Performs iterative groupby reductions.
 
         Parameters
@@ -365,6 +860,11 @@ class GroupbyMean:
             Array to be reduced.
         iterations : int, optional
             Number of reductions to perform, by default 1
+        weights : 1D array of ints, optional
+            Number of times each row of the reference data appears in target,
+            such as Bootstrapper.weights() with kind="indexes", by default None.
+            If given, the reduceat offsets are computed from weights alone
+            instead of by matching the rows of target to the reference data.
 
         Returns
         -------
@@ -372,29 +872,40 @@ class GroupbyMean:
             Array with the same number of rows as target data, but one fewer column
             for each iteration. Final column values are combined by taking the mean.
         """
+        if weights is not None:
+            multiplicity = np.asarray(weights, dtype=np.int64)
+
         for i in range(iterations):
-            key = hash((target[:, :-2]).tobytes())
+            column = target.shape[1] - 2
+            reference, counts = self.reference_dict[column]
+
+            # number of target rows in each reference cluster. this determines
+            # the reduceat offsets, so it doubles as the cache key
+            if weights is None:
+                cluster_counts = _target_cluster_counts(target[:, :-2], reference)
+            else:
+                cluster_counts = np.add.reduceat(
+                    multiplicity, np.cumsum(counts) - counts
+                )
+                multiplicity = cluster_counts // counts
+
+            key = (column, cluster_counts.tobytes())
 
             try:
                 reduce_at_list, reduce_at_counts = self.cache_dict[key]
+                self.cache_dict.move_to_end(key)
+                self.hits += 1
 
             except KeyError:
-                column = target.shape[1] - 2
-
-                reference, counts = self.reference_dict[column]
-
-                reduce_at_list = class_make_ufunc_list(
-                    target[:, :-2], reference, counts
-                )
-
-                reduce_at_counts = (
-                    np.append(reduce_at_list[1:], target[:, -2].size) - reduce_at_list
+                reduce_at_list, reduce_at_counts = _offsets_from_cluster_counts(
+                    cluster_counts, counts
                 )
 
                 self.cache_dict[key] = reduce_at_list, reduce_at_counts
+                self.misses += 1
 
-                if len(self.cache_dict.keys()) > 50:
-                    self.cache_dict.pop(list(self.cache_dict)[0])
+                if len(self.cache_dict) > self.cache_size:
+                    self.cache_dict.popitem(last=False)
 
             agg_col = np.add.reduceat(target[:, -1], reduce_at_list) / reduce_at_counts
 
@@ -412,40 +923,233 @@ class GroupbyMean:
         return self.transform(target, iterations=iterations)
 
 
+def chunked_groupby_mean(data, chunk_size=1000000):
+    """Reduces the final design column by taking the mean, reading data in
+    chunks.
+
+    Equivalent to GroupbyMean().fit_transform(data), but only holds one chunk
+    of data in memory at a time, so data can be a np.memmap that is larger
+    than memory.
+
+    Parameters
+    ----------
+    data : 2D numeric array
+        Lexicographically sorted data, such as np.load(path, mmap_mode="r").
+    chunk_size : int, optional
+        Number of rows to read at once, by default 1000000. A chunk is
+        extended to the end of the last cluster it starts, so every cluster is
+        averaged exactly as GroupbyMean would.
+
+    Returns
+    -------
+    2D array of float64s
+        One row per cluster of the final design column, with one fewer column
+        than data.
+
+    Raises
+    ------
+    ValueError
+        If data is not lexicographically sorted.
+    """
+    n_rows = data.shape[0]
+    n_levels = data.shape[1] - 2
+    reduced = []
+    start = 0
+    size = chunk_size
+    while start < n_rows:
+        # read one row past the chunk to see whether its last cluster goes on
+        stop = min(start + size + 1, n_rows)
+        chunk = np.asarray(data[start:stop], dtype=np.float64)
+        design = chunk[:, :-1]
+        if not _is_lexsorted(design):
+            raise ValueError("data must be lexicographically sorted.")
+
+        starts = np.flatnonzero(_first_difference(design) < n_levels)
+        if stop == n_rows:
+            end = chunk.shape[0]
+        elif starts.size > 1:
+            # the final cluster may continue past this chunk, so leave it for
+            # the next one
+            end = starts[-1]
+            starts = starts[:-1]
+        else:
+            # one cluster fills the whole chunk, so read more of it
+            size *= 2
+            continue
+
+        counts = np.diff(np.append(starts, end))
+        cluster_means = chunk[starts, :-1]
+        cluster_means[:, -1] = np.add.reduceat(chunk[:end, -1], starts) / counts
+        reduced.append(cluster_means)
+
+        start += end
+        size = chunk_size
+
+    if not reduced:
+        return np.empty((0, data.shape[1] - 1))
+    return np.concatenate(reduced)
+
+
+@nb.jit(nopython=True, inline="always")
+def _rows_differ(a, b):
+    """Whether two 1D arrays of the same length differ in any element."""
+    for j in range(a.size):
+        if a[j] != b[j]:
+            return True
+    return False
+
+
+@nb.jit(nopython=True, cache=True)
+def _target_cluster_counts(target, reference):
+    """Counts the rows of a lexsorted target that belong to each row of
+    reference, the lexsorted unique rows of the reference data.
+    """
+    cluster_counts = np.zeros(reference.shape[0], dtype=np.int64)
+    idx = 0
+    for i in range(target.shape[0]):
+        # both arrays are sorted, so the matching reference row is never behind
+        while idx < reference.shape[0] and _rows_differ(target[i], reference[idx]):
+            idx += 1
+        if idx == reference.shape[0]:
+            raise ValueError("target contains clusters that are not in reference.")
+        cluster_counts[idx] += 1
+    return cluster_counts
+
+
 @nb.jit(nopython=True, cache=True)
-def class_make_ufunc_list(target, reference, counts):
-    """Makes a list of indices to perform a ufunc.reduceat operation along.
+def _offsets_from_cluster_counts(cluster_counts, counts):
+    """Reduceat offsets and group sizes that split the rows of each cluster
+    into copies of the size it has in the reference data.
+    """
+    copies = cluster_counts // counts
+    offsets = np.empty(copies.sum(), dtype=np.int64)
+    group_counts = np.empty(copies.sum(), dtype=np.int64)
+    idx = 0
+    place = 0
+    for cluster in range(counts.size):
+        for copy in range(copies[cluster]):
+            offsets[idx] = place
+            group_counts[idx] = counts[cluster]
+            place += counts[cluster]
+            idx += 1
+    return offsets, group_counts
+
+
+@nb.jit(nopython=True)
+def _pairwise_sum(values, start, n):
+    """Sums n elements of values beginning at start.
+
+    Mirrors the pairwise summation numpy uses inside ufunc reductions, so
+    results are bitwise identical to np.add.reduceat.
+    """
+    if n < 8:
+        res = 0.0
+        for i in range(start, start + n):
+            res += values[i]
+        return res
+
+    elif n <= 128:
+        r = np.empty(8)
+        for j in range(8):
+            r[j] = values[start + j]
+        i = 8
+        while i < n - (n % 8):
+            for j in range(8):
+                r[j] += values[start + i + j]
+            i += 8
+        res = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+        while i < n:
+            res += values[start + i]
+            i += 1
+        return res
+
+    else:
+        n2 = n // 2
+        n2 -= n2 % 8
+        return _pairwise_sum(values, start, n2) + _pairwise_sum(
+            values, start + n2, n - n2
+        )
+
+
+@nb.jit(nopython=True, cache=True)
+def _group_mean(values, start, n):
+    """Mean of n elements of values beginning at start, as np.add.reduceat
+    would compute it.
+    """
+    return (values[start] + _pairwise_sum(values, start + 1, n - 1)) / n
 
-    This is necessary when an aggregation operation is performed
-    while grouping by a column that was resampled. The target array
-    must be lexsorted.
+
+@nb.jit(nopython=True, cache=True)
+def nb_groupby_mean(values, offsets, counts, bounds):
+    """Iterative groupby-mean reduction over a design that does not change.
+
+    Numba-accelerated equivalent of GroupbyMean.transform for the dependent
+    variable column alone. Use GroupbyMean.fixed_offsets to generate the
+    offsets, counts, and bounds arguments.
 
     Parameters
     ----------
-    target : 2D numeric array
-        Array that the groupby-aggregate operation will be performed on.
-    reference : 2D numeric array
-        Unique rows in target for the column that will be aggregated to.
+    values : 1D array of float64s
+        Dependent variable values, in the row order of the fitted design.
+    offsets : 1D array of ints
+        Concatenated reduceat offsets for every reduction.
     counts : 1D array of ints
-        Number of times each row in reference should appear in target.
+        Concatenated group sizes for every reduction.
+    bounds : 1D array of ints
+        Entries i and i + 1 delimit the offsets and counts of reduction i.
 
     Returns
     -------
-    1D array of ints
-        Indices to reduceat along.
+    1D array of float64s
+        Mean of values within each group after the final reduction.
     """
+    for level in range(bounds.size - 1):
+        reduced = np.empty(bounds[level + 1] - bounds[level])
+        for idx in range(reduced.size):
+            start = offsets[bounds[level] + idx]
+            n = counts[bounds[level] + idx]
+            reduced[idx] = _group_mean(values, start, n)
+        values = reduced
+    return values
 
-    ufunc_list = np.empty(len(reference), dtype=np.int64)
-    i = 0
 
-    if reference.shape[1] > 1:
-        for idx, _ in enumerate(ufunc_list):
-            ufunc_list[idx] = i
-            i += counts[np.all((reference == target[i]), axis=1)][0]
+@nb.jit(nopython=True, cache=True)
+def nb_weighted_groupby_mean(values, weights, offsets, counts, bounds):
+    """Iterative groupby-mean reduction of weighted values over a design that
+    does not change.
 
-    else:
-        for idx, _ in enumerate(ufunc_list):
-            ufunc_list[idx] = i
-            i += counts[(reference == target[i]).flatten()].item()
+    Equivalent to nb_groupby_mean(values * weights, offsets, counts, bounds),
+    but only ever holds the weighted values of one group at a time.
 
-    return ufunc_list
+    Parameters
+    ----------
+    values : 1D array of float64s
+        Dependent variable values, in the row order of the fitted design.
+    weights : 1D array
+        Weight of each value, such as from Bootstrapper.weights.
+    offsets, counts, bounds : 1D arrays of ints
+        See nb_groupby_mean.
+
+    Returns
+    -------
+    1D array of float64s
+        Mean of weighted values within each group after the final reduction.
+    """
+    if bounds.size == 1:
+        return values * weights
+
+    scratch = np.empty(counts[bounds[0] : bounds[1]].max())
+    for level in range(bounds.size - 1):
+        reduced = np.empty(bounds[level + 1] - bounds[level])
+        for idx in range(reduced.size):
+            start = offsets[bounds[level] + idx]
+            n = counts[bounds[level] + idx]
+            if level == 0:
+                # weight one group at a time, then sum exactly as numpy would
+                for i in range(n):
+                    scratch[i] = values[start + i] * weights[start + i]
+                reduced[idx] = _group_mean(scratch, 0, n)
+            else:
+                reduced[idx] = _group_mean(values, start, n)
+        values = reduced
+    return values
@@ -1,15 +1,15 @@
 from functools import lru_cache
-from itertools import cycle
-from typing import Callable, Dict, Generator, Iterable, Union
+from typing import Callable, Dict, Generator, Iterable, Optional, Tuple, Union
 
 import numpy as np
 from numba import jit
 
 from hierarch.internal_functions import (
-    _repeat,
     id_cluster_counts,
-    msp,
+    msp_state,
+    n_multiset_permutations,
     nb_fast_shuffle,
+    nb_msp_fill,
     nb_strat_shuffle,
     nb_unique,
     set_numba_random_state,
@@ -229,13 +229,14 @@ class Bootstrapper:
         else:
             raise KeyError("Invalid 'kind' argument.")
 
-    def fit(self, data: np.ndarray, skip=None, y=-1) -> None:
+    def fit(self, data: np.ndarray, skip=None, y=-1, hierarchy=None) -> None:
         """Fit the bootstrapper to the target data.
 
         Parameters
         ----------
         data : 2D array
-            Target data. Must be lexicographically sorted.
+            Target data. Must be lexicographically sorted. Can be a np.memmap,
+            as fit() does not copy data and weights() never reads it.
         sort : bool
             Set to false is data is already sorted by row, by default True.
         skip : list of integers, optional
@@ -243,6 +244,8 @@ class Bootstrapper:
             without replacement from the prior column, by default [].
         y : int, optional
             column index of the dependent variable, by default -1
+        hierarchy : Hierarchy, optional
+            Precomputed Hierarchy of data, by default None
 
         Raises
         ------
@@ -274,8 +277,11 @@ class Bootstrapper:
         else:
             skip = []
 
-        cluster_dict = id_cluster_counts(data[:, :y])
-        cluster_dict = tuple(reversed(list(cluster_dict.values())))
+        if hierarchy is not None:
+            cluster_dict = hierarchy.cluster_counts[: y % data.shape[1]]
+        else:
+            cluster_dict = id_cluster_counts(data[:, :y])
+            cluster_dict = tuple(reversed(list(cluster_dict.values())))
         cluster_dict = tuple(map(tuple, cluster_dict))
         y %= data.shape[1]
         shape = y
@@ -289,6 +295,12 @@ class Bootstrapper:
         self.transform = _bootstrapper_factory(
             tuple(columns_to_resample), cluster_dict, shape, kind
         )
+        self.weights, self.weights_batch = _bootstrap_weights_factory(
+            tuple(columns_to_resample), cluster_dict, shape, kind
+        )
+        self.transform_batch = _bootstrapper_batch_factory(
+            tuple(columns_to_resample), cluster_dict, shape, kind
+        )
 
     def transform(self, data: np.ndarray, start: int) -> np.ndarray:
         """Generate a bootstrapped sample from target data.
@@ -309,6 +321,78 @@ class Bootstrapper:
         """
         raise Exception("Use fit() before using transform().")
 
+    def weights(self, start: int) -> np.ndarray:
+        """Generate the bootstrap weight of each row of the fitted data.
+
+        transform() multiplies the dependent variable by these weights if
+        "kind" is "weights" or "bayesian" and repeats each row that many
+        times if "kind" is "indexes". Consumes the same random numbers as
+        transform(), but does not copy the data.
+
+        Parameters
+        ----------
+        start : int
+            Column index of the first column to be bootstrapped.
+
+        Returns
+        -------
+        1D array
+            Weight of each row, ints unless "kind" is "bayesian".
+        """
+        raise Exception("Use fit() before using weights().")
+
+    def weights_batch(
+        self, start: int, n: int, stop: Optional[int] = None
+    ) -> np.ndarray:
+        """Generate n sets of bootstrap weights at once.
+
+        Row i matches the weights from the i-th of n successive calls to
+        weights(), but all n are drawn in a single compiled loop.
+
+        Parameters
+        ----------
+        start : int
+            Column index of the first column to be bootstrapped.
+        n : int
+            Number of bootstrapped samples to generate.
+        stop : int, optional
+            Weight each distinct combination of the first stop columns
+            rather than each row, by default None. For example, stop=2
+            gives the weight of each cluster in column 1 and only
+            resamples columns start through 1.
+
+        Returns
+        -------
+        2D array
+            Array of shape (n, rows), or (n, clusters) if stop is given.
+            Ints unless "kind" is "bayesian".
+        """
+        raise Exception("Use fit() before using weights_batch().")
+
+    def transform_batch(self, data: np.ndarray, start: int, n: int) -> np.ndarray:
+        """Generate n bootstrapped dependent variable columns at once.
+
+        Equivalent to stacking the last column after each of n successive
+        calls to transform(), but runs in a single compiled loop. Only
+        available if "kind" is "weights" or "bayesian".
+
+        Parameters
+        ----------
+        data : 2D array
+            Target data. Must be sorted by row.
+        start : int
+            Column index of the first column to be bootstrapped.
+        n : int
+            Number of bootstrapped samples to generate.
+
+        Returns
+        -------
+        2D array
+            Array of shape (n, len(data)). Each row is the dependent variable
+            multiplied by one set of bootstrap weights.
+        """
+        raise Exception("Use fit() before using transform_batch().")
+
 
 @lru_cache()
 def _bootstrapper_factory(
@@ -316,25 +400,79 @@ def _bootstrapper_factory(
 ) -> Callable:
     """Factory function that returns the appropriate transform()."""
 
+    _bootstrap_algorithm, _ = _bootstrap_weights_factory(
+        columns_to_resample, clusternum_dict, shape, kind
+    )
+
+    if kind in ("weights", "bayesian"):
+
+        @jit(nopython=True)
+        def _bootstrapper_impl(data, start):
+            out = data.astype(np.float64)
+            weights = _bootstrap_algorithm(start)
+            out[:, -1] = out[:, -1] * weights
+            return out
+
+    elif kind == "indexes":
+
+        @jit(nopython=True)
+        def _bootstrapper_impl(data, start):
+            out = data.astype(np.float64)
+            weights = _bootstrap_algorithm(start)
+            indexes = weights_to_index(weights)
+            return out[indexes]
+
+    return _bootstrapper_impl
+
+
+@lru_cache()
+def _bootstrapper_batch_factory(
+    columns_to_resample: int, clusternum_dict: Dict, shape: int, kind: str
+) -> Callable:
+    """Factory function that returns the appropriate transform_batch()."""
+
+    _, _bootstrap_batch_algorithm = _bootstrap_weights_factory(
+        columns_to_resample, clusternum_dict, shape, kind
+    )
+
+    if kind in ("weights", "bayesian"):
+
+        @jit(nopython=True)
+        def _bootstrapper_batch_impl(data, start, n):
+            return data[:, -1].astype(np.float64) * _bootstrap_batch_algorithm(start, n)
+
+    elif kind == "indexes":
+
+        def _bootstrapper_batch_impl(data, start, n):
+            raise ValueError(
+                "transform_batch() requires kind='weights' or 'bayesian'. "
+                "Use weights_batch() instead."
+            )
+
+    return _bootstrapper_batch_impl
+
+
+@lru_cache()
+def _bootstrap_weights_factory(
+    columns_to_resample: int, clusternum_dict: Dict, shape: int, kind: str
+) -> Tuple[Callable, Callable]:
+    """Factory function that returns the appropriate weights() and weights_batch()."""
+
     # these helper functions wrap the distributions so that they take the same arguments
     @jit(nopython=True)
-    def _multinomial_distribution(weights, idx, v):
-        return np.random.multinomial(v * weights[idx], [1 / v] * v)
+    def _multinomial_distribution(weights, idx, v, parameters):
+        return np.random.multinomial(v * weights[idx], parameters)
 
     @jit(nopython=True)
-    def _dirichlet_distribution(weights, idx, v):
-        return (
-            np.random.dirichlet([1 for a in range(v.item())], size=None)
-            * weights[idx]
-            * v.item()
-        )
+    def _dirichlet_distribution(weights, idx, v, parameters):
+        return np.random.dirichlet(parameters, size=None) * weights[idx] * v.item()
 
     @jit(nopython=True)
-    def _bootstrap_algorithm(data, start):
+    def _bootstrap_weights(start, stop):
         # at the start, everything is weighted equally
         weights = np.array([1 for i in clusternum_dict[start]], dtype=_weight_dtype)
 
-        for key in range(start, shape):
+        for key in range(start, stop):
             # fetch design matrix info for current column
             to_do = clusternum_dict[key]
             # preallocate the full array for new_weight
@@ -344,22 +482,36 @@ def _bootstrapper_factory(
             # if not resampling this column, new_weight is the prior column's weights
             if not columns_to_resample[key]:
                 for idx, v in enumerate(to_do):
-                    new_weight[place : place + v] = np.array(
-                        [weights[idx] for m in range(v.item())]
-                    )
+                    new_weight[place : place + v] = weights[idx]
                     place += v
 
             # else do a multinomial experiment to generate new_weight
             else:
+                parameters = distribution_parameters[key]
+                parameter_starts = parameter_offsets[key]
                 for idx, v in enumerate(to_do):
+                    first = parameter_starts[idx]
                     # v*weights[idx] carries over weights from previous columns
-                    new_weight[place : place + v] = _dist(weights, idx, v)
+                    new_weight[place : place + v] = _dist(
+                        weights, idx, v, parameters[first : first + v]
+                    )
                     place += v
 
             weights = new_weight
 
         return weights
 
+    @jit(nopython=True)
+    def _bootstrap_algorithm(start):
+        return _bootstrap_weights(start, shape)
+
+    @jit(nopython=True)
+    def _bootstrap_batch_algorithm(start, n, stop=shape):
+        out = np.empty((n, n_weights[stop]), dtype=_weight_dtype)
+        for i in range(n):
+            out[i] = _bootstrap_weights(start, stop)
+        return out
+
     clusternum_dict = tuple(np.array(cluster) for cluster in clusternum_dict)
     columns_to_resample = np.array(columns_to_resample)
 
@@ -367,39 +519,41 @@ def _bootstrapper_factory(
         _weight_dtype = np.int64
         _dist = _multinomial_distribution
 
+        def _parameters(v):
+            return np.full(v, 1 / v)
+
     elif kind in ("bayesian"):
         # bayesian bootstrap produces non-integer weights
         _weight_dtype = np.float64
         _dist = _dirichlet_distribution
 
-    if kind in ("weights", "bayesian"):
-
-        @jit(nopython=True)
-        def _bootstrapper_impl(data, start):
-            out = data.astype(np.float64)
-            weights = _bootstrap_algorithm(out, start)
-            out[:, -1] = out[:, -1] * weights
-            return out
-
-    elif kind == "indexes":
-
-        @jit(nopython=True)
-        def _bootstrapper_impl(data, start):
-            out = data.astype(np.float64)
-            weights = _bootstrap_algorithm(out, start)
-            indexes = weights_to_index(weights)
-            return out[indexes]
+        def _parameters(v):
+            return np.ones(v)
 
     else:
         raise KeyError(
             "No such bootstrapping algorithm. kind must be 'weights' or 'indexes' or 'bayesian'"
         )
 
-    return _bootstrapper_impl
+    # clusters of the same size share one vector of distribution parameters,
+    # computed once here rather than for every cluster of every replicate
+    distribution_parameters, parameter_offsets = [], []
+    for cluster in clusternum_dict:
+        sizes, which = np.unique(cluster, return_inverse=True)
+        distribution_parameters.append(
+            np.concatenate([_parameters(v) for v in sizes] + [np.empty(0)])
+        )
+        parameter_offsets.append((np.cumsum(sizes) - sizes)[which.ravel()])
+    distribution_parameters = tuple(distribution_parameters)
+    parameter_offsets = tuple(parameter_offsets)
 
+    # number of weights generated when stopping before each column
+    n_weights = (1,) + tuple(int(cluster.sum()) for cluster in clusternum_dict)
+
+    return _bootstrap_algorithm, _bootstrap_batch_algorithm
 
-class Permuter:
 
+class Permuter:
     """Class for performing cluster-aware permutation on a target column.
 
     Parameters
@@ -459,6 +613,13 @@ class Permuter:
     >>> next(permute.iterator)
     [2.0, 1.0, 2.0, 2.0, 1.0, 1.0]
 
+    If exact="auto", Permuter only enumerates permutations if there are no
+    more than budget of them.
+
+    >>> permute.fit(test, col_to_permute=0, exact="auto", budget=10)
+    >>> permute.n_permutations, permute.exact
+    (20, False)
+
     If the column to permute is not 0, Permuter performs a within-cluster shuffle.
     Note that values of column 1 were shuffled within their column 0 cluster.
 
@@ -473,14 +634,27 @@ class Permuter:
            [2., 1., 1.],
            [2., 3., 1.]])
 
-    Exact within-cluster permutations are not implemented, but there are typically
-    too many to be worth attempting.
+    Exact within-cluster permutations enumerate every combination of
+    the distinct permutations within each cluster.
 
-    >>> permute = Permuter(random_state=2)
+    >>> permute = Permuter()
     >>> permute.fit(test, col_to_permute=1, exact=True)
-    Traceback (most recent call last):
-        ...
-    NotImplementedError: Exact permutation only available for col_to_permute = 0.
+    >>> permute.n_permutations
+    36
+    >>> permute.transform(test)
+    array([[1., 3., 1.],
+           [1., 2., 1.],
+           [1., 1., 1.],
+           [2., 3., 1.],
+           [2., 2., 1.],
+           [2., 1., 1.]])
+    >>> permute.transform(test)
+    array([[1., 3., 1.],
+           [1., 2., 1.],
+           [1., 1., 1.],
+           [2., 1., 1.],
+           [2., 3., 1.],
+           [2., 2., 1.]])
     """
 
     def __init__(
@@ -491,7 +665,14 @@ class Permuter:
             nb_seed = self.random_generator.integers(low=2**32)
             set_numba_random_state(nb_seed)
 
-    def fit(self, data: np.ndarray, col_to_permute: int, exact: bool = False) -> None:
+    def fit(
+        self,
+        data: np.ndarray,
+        col_to_permute: int,
+        exact: Union[bool, str] = False,
+        budget: int = 1000,
+        hierarchy=None,
+    ) -> None:
         """Fit the permuter to the target data.
 
         Parameters
@@ -500,45 +681,70 @@ class Permuter:
             Target data.
         col_to_permute : int
             Index of target column.
-        exact : bool, optional
+        exact : bool or "auto", optional
             If True, will enumerate all possible permutations and
-            iterate through them one by one, by default False. Only
-            works if target column has index 0.
+            iterate through them one by one, by default False. If the
+            target column is not column 0, permutations are enumerated
+            within each cluster of the previous column. The number of
+            distinct permutations is stored as n_permutations. If "auto",
+            permutations are enumerated if there are no more than budget
+            of them. The choice is stored as exact.
+        budget : int, optional
+            Largest number of permutations to enumerate when exact is "auto",
+            by default 1000.
+        hierarchy : Hierarchy, optional
+            Precomputed Hierarchy of data, by default None
         """
-        values, indexes, counts = np.unique(
-            data[:, : col_to_permute + 2], return_index=True, return_counts=True, axis=0
-        )
+        if hierarchy is not None:
+            level = col_to_permute + 2
+            values = hierarchy.uniques[level]
+            indexes = hierarchy.offsets[level][:-1]
+            counts = np.diff(hierarchy.offsets[level])
+            keys = np.searchsorted(indexes, hierarchy.offsets[col_to_permute])
 
-        if col_to_permute != 0 and exact is True:
-            raise NotImplementedError(
-                "Exact permutation only available for col_to_permute = 0."
+        else:
+            values, indexes, counts = np.unique(
+                data[:, : col_to_permute + 2],
+                return_index=True,
+                return_counts=True,
+                axis=0,
             )
 
+            try:
+                values[:, -3]
+                keys = nb_unique(values[:, :-2])[1]
+                keys = np.append(keys, values[:, -3].shape[0])
+            except IndexError:
+                keys = np.zeros(1, dtype=np.int64)
+                keys = np.append(keys, values[:, -2].shape[0])
+
         # transform() is going to be called a lot, so generate a specialized version on the fly
         # this keeps us from having to do unnecessary flow control
 
-        if exact is True:
+        if exact is True or exact == "auto":
             col_values = values[:, -2].copy()
-            self.iterator = cycle(msp(col_values))
+            self.n_permutations = n_multiset_permutations(col_values, keys)
+            exact = exact is True or self.n_permutations <= budget
+        self.exact = exact
+
+        if exact:
+            enumerator = (*msp_state(col_values, keys), keys)
+            self.iterator = _exact_iterator(enumerator)
             if len(col_values) == len(data):
-                self.transform = _exact_return(col_to_permute, self.iterator)
+                self.transform = _exact_return(col_to_permute, enumerator)
+                self.transform_batch = _exact_batch_return(enumerator, None)
             else:
                 self.transform = _exact_repeat_return(
-                    col_to_permute, self.iterator, counts
+                    col_to_permute, enumerator, counts
                 )
+                self.transform_batch = _exact_batch_return(enumerator, counts)
 
         else:
-            try:
-                values[:, -3]
-                keys = nb_unique(values[:, :-2])[1]
-                keys = np.append(keys, values[:, -3].shape[0])
-            except IndexError:
-                keys = np.zeros(1, dtype=np.int64)
-                keys = np.append(keys, values[:, -2].shape[0])
             keys = tuple(keys.tolist())
 
             if indexes.size == len(data):
                 self.transform = _random_return(col_to_permute, keys)
+                self.transform_batch = _random_batch_return(col_to_permute, keys)
 
             else:
                 col_values = data[:, col_to_permute][indexes]
@@ -547,6 +753,9 @@ class Permuter:
                 self.transform = _random_repeat_return(
                     col_to_permute, col_values, keys, counts
                 )
+                self.transform_batch = _random_repeat_batch_return(
+                    col_to_permute, col_values, keys, counts
+                )
 
     def transform(self, data: np.ndarray) -> np.ndarray:
         """Permute target column in-place.
@@ -566,33 +775,82 @@ class Permuter:
         # four static methods defined below
         raise Exception("Use fit() before using transform().")
 
+    def transform_batch(self, data: np.ndarray, k: int) -> np.ndarray:
+        """Generate k permutations of the target column at once.
 
-def _exact_return(
-    col_to_permute: int, generator: Generator[Iterable, None, None]
-) -> Callable:
+        Equivalent to stacking the target column after each of k successive
+        calls to transform() on a copy of the data, but does not modify the
+        data and, when exact is False, runs in a single compiled loop.
+
+        Parameters
+        ----------
+        data : 2D numeric ndarray
+            Target data.
+        k : int
+            Number of permutations to generate.
+
+        Returns
+        -------
+        2D numeric ndarray
+            Array of shape (k, len(data)). Each row is one permutation of the
+            target column.
+        """
+        raise Exception("Use fit() before using transform_batch().")
+
+
+def _exact_iterator(enumerator: tuple) -> Generator[list, None, None]:
+    """Endlessly yield permutations from an enumerator as lists."""
+    val = enumerator[0]
+    row = np.empty((1, val.size), dtype=val.dtype)
+    while True:
+        nb_msp_fill(*enumerator, row)
+        yield row[0].tolist()
+
+
+def _exact_return(col_to_permute: int, enumerator: tuple) -> Callable:
     """Transformer when exact is True and permutations are unrestricted."""
+    val = enumerator[0]
+    row = np.empty((1, val.size), dtype=val.dtype)
 
     def _exact_return_impl(data):
-        data[:, col_to_permute] = next(generator)
+        nb_msp_fill(*enumerator, row)
+        data[:, col_to_permute] = row[0]
         return data
 
     return _exact_return_impl
 
 
 def _exact_repeat_return(
-    col_to_permute: int, generator: Generator[Iterable, None, None], counts: Iterable
+    col_to_permute: int, enumerator: tuple, counts: np.ndarray
 ) -> Callable:
     """Transformer when exact is True and permutations are restricted by
     repetition of treated entities.
     """
+    val = enumerator[0]
+    row = np.empty((1, val.size), dtype=val.dtype)
 
     def _rep_iter_return_impl(data):
-        data[:, col_to_permute] = _repeat(tuple(next(generator)), counts)
+        nb_msp_fill(*enumerator, row)
+        data[:, col_to_permute] = row[0].repeat(counts)
         return data
 
     return _rep_iter_return_impl
 
 
+def _exact_batch_return(enumerator: tuple, counts: Optional[np.ndarray]) -> Callable:
+    """Batch transformer when exact is True."""
+    val = enumerator[0]
+
+    def _exact_batch_return_impl(data, k):
+        out = np.empty((k, val.size), dtype=data.dtype)
+        nb_msp_fill(*enumerator, out)
+        if counts is not None:
+            out = out.repeat(counts, axis=1)
+        return out
+
+    return _exact_batch_return_impl
+
+
 @lru_cache()
 def _random_return(col_to_permute: int, keys: Iterable) -> Callable:
     """Transformer when exact is False and repetition is not required."""
@@ -640,3 +898,64 @@ def _random_repeat_return(
             return data
 
     return _random_repeat_return_impl
+
+
+@lru_cache()
+def _random_batch_return(col_to_permute: int, keys: Iterable) -> Callable:
+    """Batch transformer when exact is False and repetition is not required."""
+
+    if col_to_permute == 0:
+
+        @jit(nopython=True)
+        def _random_batch_return_impl(data, k):
+            shuffled = data[:, col_to_permute].copy()
+            out = np.empty((k, shuffled.size), dtype=shuffled.dtype)
+            for i in range(k):
+                nb_fast_shuffle(shuffled)
+                out[i] = shuffled
+            return out
+
+    else:
+
+        @jit(nopython=True)
+        def _random_batch_return_impl(data, k):
+            shuffled = data[:, col_to_permute].copy()
+            out = np.empty((k, shuffled.size), dtype=shuffled.dtype)
+            for i in range(k):
+                nb_strat_shuffle(shuffled, keys)
+                out[i] = shuffled
+            return out
+
+    return _random_batch_return_impl
+
+
+@lru_cache()
+def _random_repeat_batch_return(
+    col_to_permute: int, col_values: Iterable, keys: Iterable, counts: Iterable
+) -> Callable:
+    """Batch transformer when exact is False and repetition is required."""
+    col_values = np.array(col_values)
+    counts = np.array(counts)
+    if col_to_permute == 0:
+
+        @jit(nopython=True)
+        def _random_repeat_batch_return_impl(data, k):
+            out = np.empty((k, counts.sum()), dtype=data.dtype)
+            for i in range(k):
+                shuffled_col_values = col_values.copy()
+                nb_fast_shuffle(shuffled_col_values)
+                out[i] = np.repeat(shuffled_col_values, counts)
+            return out
+
+    else:
+
+        @jit(nopython=True)
+        def _random_repeat_batch_return_impl(data, k):
+            out = np.empty((k, counts.sum()), dtype=data.dtype)
+            for i in range(k):
+                shuffled_col_values = col_values.copy()
+                nb_strat_shuffle(shuffled_col_values, keys)
+                out[i] = np.repeat(shuffled_col_values, counts)
+            return out
+
+    return _random_repeat_batch_return_impl
@@ -1,60 +1,88 @@
-import math
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from itertools import combinations
-from typing import Collection, Generator, Optional, Union
+from statistics import NormalDist
+from typing import Collection, Generator, Optional, Tuple, Union
 from warnings import simplefilter, warn
 
 import numpy as np
 import pandas as pd
-from numba import jit
+import numba
+from numba import jit, prange
 
 from hierarch.internal_functions import (
     GroupbyMean,
+    Hierarchy,
+    _is_lexsorted,
     bivar_central_moment,
+    bivar_central_sums,
+    chunked_groupby_mean,
+    nb_weighted_groupby_mean,
+    set_numba_random_state,
+    weights_to_index,
 )
 from hierarch.resampling import Bootstrapper, Permuter
 
 
-def _preprocess_data(data):
+def _preprocess_data(data, return_labels=False):
     """Performs label encoding without overwriting numerical variables.
 
+    Only columns that cannot be cast to np.float64 are encoded, as codes
+    that follow the sorted order of their values, or the order of the
+    categories of a non-numeric pandas Categorical. Rows are then sorted
+    lexicographically, unless they already are.
+
     Parameters
     ----------
     data : 2D array or pandas DataFrame
         Data to be encoded.
+    return_labels : bool, optional
+        Also return the value that each code stands for, by default False
 
     Returns
     -------
     2D array of float64s
         An array identical to data, but all elements that cannot be cast
         to np.float64s replaced with integer values.
+    dict
+        Maps the index of each encoded column to an array whose i-th element
+        is the value encoded as i. Only returned if return_labels is True.
     """
-    # don't want to overwrite data
-    if isinstance(data, np.ndarray):
-        encoded = data.copy()
-
-    # coerce dataframe to numpy array
-    elif isinstance(data, pd.DataFrame):
-        encoded = data.to_numpy()
+    labels = {}
 
-    for idx, v in enumerate(encoded.T):
-        # attempt to cast array as floats
-        try:
-            encoded = encoded.astype(np.float64)
-            # if we can cast the array as floats, encoding is complete
-            break
+    # numeric arrays only need to be cast once
+    if isinstance(data, np.ndarray) and np.issubdtype(data.dtype, np.number):
+        encoded = data.astype(np.float64)
 
-        except ValueError:
-            # if we can't, attempt to cast one column as floats
+    else:
+        if isinstance(data, pd.DataFrame):
+            columns = (column for _, column in data.items())
+        else:
+            columns = iter(data.T)
+
+        encoded = np.empty(data.shape, dtype=np.float64)
+        for idx, column in enumerate(columns):
+            if isinstance(column.dtype, pd.CategoricalDtype) and not (
+                pd.api.types.is_numeric_dtype(column.cat.categories)
+            ):
+                encoded[:, idx] = column.cat.codes
+                labels[idx] = column.cat.categories.to_numpy()
+                continue
+            # attempt to cast the column as floats
             try:
-                encoded[:, idx] = encoded[:, idx].astype(np.float64)
-            # if we still can't, encode that column
-            except ValueError:
-                encoded[:, idx] = np.unique(v, return_inverse=True)[1]
-    # stable sort sort the output by row
-    encoded = np.unique(encoded, axis=0)
-    encoded = encoded.astype(np.float64)
-
+                encoded[:, idx] = np.asarray(column, dtype=np.float64)
+            # if we can't, encode that column
+            except (TypeError, ValueError):
+                codes, uniques = pd.factorize(np.asarray(column), sort=True)
+                encoded[:, idx] = codes
+                labels[idx] = uniques
+
+    # stable sort the output by row
+    if not _is_lexsorted(encoded):
+        encoded = encoded[np.lexsort(encoded.T[::-1])]
+
+    if return_labels:
+        return encoded, labels
     return encoded
 
 
@@ -103,29 +131,14 @@ def studentized_covariance(x, y):
 
     """
     n = len(x)
+    sum_xy, sum_x2y2, sum_xx, sum_yy = bivar_central_sums(x, y)
 
     # numerator is the sample covariance, or the first symmetric bivariate central moment
-    numerator = bivar_central_moment(x, y, pow=1, ddof=1)
+    numerator = sum_xy / (n - 1)
 
     # the denominator is the sample standard deviation of the sample covariance, aka
-    # the standard error of sample covariance. the denominator has three terms.
-
-    # first term is the second symmetric bivariate central moment. an approximate
-    # bias correction of n - root(2) is applied
-    denom_1 = bivar_central_moment(x, y, pow=2, ddof=2**0.5)
-
-    # second term is the product of the standard deviations of x and y over n - 1.
-    # this term rapidly goes to 0 as n goes to infinity
-    denom_2 = (
-        bivar_central_moment(x, x, pow=1, ddof=1)
-        * bivar_central_moment(y, y, pow=1, ddof=1)
-    ) / (n - 1)
-
-    # third term is the square of the covariance of x and y. an approximate bias
-    # correction of n - root(3) is applied
-    denom_3 = ((n - 2) * (bivar_central_moment(x, y, pow=1, ddof=1.75) ** 2)) / (n - 1)
-
-    t = (numerator) / ((1 / (n - 1.5)) * (denom_1 + denom_2 - denom_3)) ** 0.5
+    # the standard error of sample covariance.
+    t = numerator / _std_error_from_sums(n, sum_xy, sum_x2y2, sum_xx, sum_yy)
     return t
 
 
@@ -193,6 +206,187 @@ def welch_statistic(sample_a, sample_b):
     return t
 
 
+@jit(nopython=True, cache=True, nogil=True)
+def studentized_covariance_batch(X, y):
+    """Studentized sample covariance between many x vectors and one y vector.
+
+    Computes studentized_covariance(X[i], y) for every row of X. The y moments
+    are computed once, and each row needs one pass for its mean and one pass
+    for every remaining sum.
+
+    Parameters
+    ----------
+    X : 2D numeric array
+        Each row is an x vector, such as a permutation of the treatment column.
+    y : 1D numeric array
+
+    Returns
+    -------
+    1D array of float64s
+        Studentized covariance for each row of X.
+
+    Examples
+    --------
+    >>> X = np.array([[0, 0, 0, 0, 0, 1, 1, 1, 1, 1],
+    ...               [1, 0, 0, 0, 0, 0, 1, 1, 1, 1]])
+    >>> y = np.array([1, 2, 3, 4, 5, 2, 3, 4, 5, 6])
+    >>> studentized_covariance_batch(X, y)
+    array([1.00396904, 0.57956573])
+    >>> studentized_covariance(X[1], y)
+    0.5795657304383097
+
+    """
+    k, n = X.shape
+
+    mean_y = 0.0
+    for i in range(n):
+        mean_y += y[i]
+    mean_y /= n
+
+    dev_y = np.empty(n)
+    sum_sq_y = 0.0
+    for i in range(n):
+        dev_y[i] = y[i] - mean_y
+        sum_sq_y += dev_y[i] ** 2
+
+    out = np.empty(k)
+    for j in range(k):
+        x = X[j]
+
+        mean_x = 0.0
+        for i in range(n):
+            mean_x += x[i]
+        mean_x /= n
+
+        # one pass gives every sum needed for the numerator and denominator
+        sum_xy = sum_x2y2 = sum_sq_x = 0.0
+        for i in range(n):
+            dev_x = x[i] - mean_x
+            sum_xy += dev_x * dev_y[i]
+            sum_x2y2 += (dev_x**2) * (dev_y[i] ** 2)
+            sum_sq_x += dev_x**2
+
+        out[j] = (sum_xy / (n - 1)) / _std_error_from_sums(
+            n, sum_xy, sum_x2y2, sum_sq_x, sum_sq_y
+        )
+
+    return out
+
+
+@jit(nopython=True, cache=True, nogil=True)
+def welch_statistic_batch(X, y, label):
+    """Welch's t statistic for many assignments of y to two samples.
+
+    Computes welch_statistic(y[X[i] == label], y[X[i] != label]) for every
+    row of X. Like welch_statistic, each row takes one pass for the sample
+    means and a second for the squared deviations from them, so samples
+    with the same values give the same statistic however they are ordered.
+
+    Parameters
+    ----------
+    X : 2D numeric array
+        Each row is a labeling of y, such as a permutation of the treatment column.
+    y : 1D numeric array
+    label : scalar
+        Label in X that identifies the first sample.
+
+    Returns
+    -------
+    1D array of float64s
+        Welch's t statistic for each row of X.
+
+    Examples
+    --------
+    >>> X = np.array([[0, 0, 0, 0, 0, 1, 1, 1, 1, 1],
+    ...               [1, 0, 0, 0, 0, 0, 1, 1, 1, 1]])
+    >>> y = np.array([1, 2, 3, 4, 5, 10, 11, 12, 13, 14])
+    >>> welch_statistic_batch(X, y, 0)
+    array([-9.        , -1.97443555])
+
+    """
+    k, n = X.shape
+
+    out = np.empty(k)
+    for j in range(k):
+        x = X[j]
+
+        len_a = 0
+        sum_a = sum_b = 0.0
+        for i in range(n):
+            if x[i] == label:
+                len_a += 1
+                sum_a += y[i]
+            else:
+                sum_b += y[i]
+        len_b = n - len_a
+        mean_a = sum_a / len_a
+        mean_b = sum_b / len_b
+
+        # squared deviations from each sample's own mean do not lose precision
+        # to cancellation the way raw sums of squares do
+        sum_sq_a = sum_sq_b = 0.0
+        for i in range(n):
+            if x[i] == label:
+                sum_sq_a += (y[i] - mean_a) ** 2
+            else:
+                sum_sq_b += (y[i] - mean_b) ** 2
+
+        var_weight_one = (sum_sq_a / (len_a - 1)) / len_a
+        var_weight_two = (sum_sq_b / (len_b - 1)) / len_b
+        out[j] = (mean_a - mean_b) / np.sqrt(var_weight_one + var_weight_two)
+
+    return out
+
+
+@jit(nopython=True, cache=True)
+def _welch_from_sums(n, len_a, sum_a, sum_sq_a, total, total_sq):
+    """Welch's t statistic from the sum and sum of squares of y within the
+    first sample and over all of y.
+    """
+    len_b = n - len_a
+    sum_b = total - sum_a
+    sum_sq_b = total_sq - sum_sq_a
+
+    meandiff = sum_a / len_a - sum_b / len_b
+    var_weight_one = ((sum_sq_a - sum_a**2 / len_a) / (len_a - 1)) / len_a
+    var_weight_two = ((sum_sq_b - sum_b**2 / len_b) / (len_b - 1)) / len_b
+
+    return meandiff / np.sqrt(var_weight_one + var_weight_two)
+
+
+@jit(nopython=True, cache=True)
+def _studentized_covariance_from_sums(
+    n, len_a, sum_a, sum_sq_a, total, total_sq, label_a, label_b
+):
+    """Studentized covariance between a two-valued x and y from the sum and
+    sum of squares of y where x == label_a and over all of y.
+    """
+    len_b = n - len_a
+
+    # x only takes two values, so its deviations only take two values
+    mean_x = (len_a * label_a + len_b * label_b) / n
+    dev_a = label_a - mean_x
+    dev_b = label_b - mean_x
+
+    # convert the raw sums of y into sums of deviations from the mean of y
+    mean_y = total / n
+    sum_dev_a = sum_a - len_a * mean_y
+    sum_dev_b = (total - sum_a) - len_b * mean_y
+    sum_sq_dev_a = sum_sq_a - 2 * mean_y * sum_a + len_a * mean_y**2
+    sum_sq_dev_b = (
+        (total_sq - sum_sq_a) - 2 * mean_y * (total - sum_a) + len_b * mean_y**2
+    )
+
+    sum_xy = dev_a * sum_dev_a + dev_b * sum_dev_b
+    sum_x2y2 = (dev_a**2) * sum_sq_dev_a + (dev_b**2) * sum_sq_dev_b
+    sum_xx = len_a * dev_a**2 + len_b * dev_b**2
+    sum_yy = total_sq - n * mean_y**2
+
+    return (sum_xy / (n - 1)) / _std_error_from_sums(
+        n, sum_xy, sum_x2y2, sum_xx, sum_yy
+    )
+
+
 @lru_cache()
 def _test_stat_factory(treatment_col, compare):
     """Prepares test statistic functions for use in hypothesis_test.
@@ -232,6 +426,90 @@ def _test_stat_factory(treatment_col, compare):
         raise KeyError("No such comparison.")
 
 
+@lru_cache()
+def _batch_stat_factory(treatment_col, compare):
+    """Prepares batched test statistic functions for use in hypothesis_test.
+
+    Parameters
+    ----------
+    treatment_col : 1D tuple
+        Treatment column in the design matrix. Needs to be a tuple
+        so lru_cache can work.
+    compare : {'means', 'corr'}
+        Specifies test statistic to return.
+
+    Returns
+    -------
+    function
+        Functions that come out of _batch_stat_factory take a 2D array whose
+        rows are treatment columns and the dependent variable column to compute
+        a 1D array of test statistics.
+
+    """
+    if compare == "means":
+        treatment_labels = np.unique(treatment_col)
+        if treatment_labels.size != 2:
+            raise ValueError("Needs 2 samples.")
+        label = treatment_labels[0]
+
+        @jit(nopython=True, nogil=True)
+        def _welch_stat_batch(X, y):
+            return welch_statistic_batch(X, y, label)
+
+        return _welch_stat_batch
+
+    elif compare == "corr":
+        return studentized_covariance_batch
+
+    else:
+        raise KeyError("No such comparison.")
+
+
+@lru_cache()
+def _pairwise_stat_factory(compare):
+    """Prepares batched test statistic functions for one pair of conditions
+    under many labelings of the units of every condition.
+
+    Parameters
+    ----------
+    compare : {'means', 'corr'}
+        Specifies test statistic to return.
+
+    Returns
+    -------
+    function
+        Functions that come out of _pairwise_stat_factory take a 2D array whose
+        rows are treatment columns, the dependent variable column and a pair
+        of labels, and compute a 1D array of test statistics from the units
+        that each row gives one of the two labels.
+
+    """
+    if compare == "means":
+
+        @jit(nopython=True, nogil=True)
+        def _pair_stat(x, y, label):
+            return welch_statistic(y[x == label], y[x != label])
+
+    elif compare == "corr":
+
+        @jit(nopython=True, nogil=True)
+        def _pair_stat(x, y, label):
+            return studentized_covariance(x, y)
+
+    else:
+        raise KeyError("No such comparison.")
+
+    @jit(nopython=True, nogil=True)
+    def _pairwise_stat_batch(X, y, pair):
+        out = np.empty(X.shape[0])
+        for j in range(X.shape[0]):
+            in_pair = (X[j] == pair[0]) | (X[j] == pair[1])
+            out[j] = _pair_stat(X[j][in_pair], y[in_pair], min(pair))
+        return out
+
+    return _pairwise_stat_batch
+
+
 @jit(nopython=True)
 def _grabber(X, y, treatment_labels):
     slicer = X == treatment_labels[0]
@@ -240,6 +518,297 @@ def _grabber(X, y, treatment_labels):
     return sample_a, sample_b
 
 
+def _batch_null(permuter, batch_stat, sample, out, chunk=1024):
+    """Fill out with a batched test statistic over successive permutations
+    of sample, generating at most chunk permutations at a time.
+    """
+    for first in range(0, out.size, chunk):
+        last = min(first + chunk, out.size)
+        out[first:last] = batch_stat(
+            permuter.transform_batch(sample, last - first), sample[:, -1]
+        )
+
+
+@lru_cache()
+def _null_distribution_factory(bootstrap, permutation_null, treatment_col):
+    """Fuses the resampling loop of hypothesis_test into one nopython kernel.
+
+    Parameters
+    ----------
+    bootstrap : jitted function
+        Fitted Bootstrapper.weights. The weighted y column is aggregated
+        directly, so no resampled copy of the data is ever made.
+    permutation_null : jitted function
+        Kernel from _permutation_null_factory or _swap_null_factory.
+    treatment_col : int
+
+    Returns
+    -------
+    function
+        Kernel that fills a preallocated null distribution in place for a range
+        of replicates. Replicate 0 is the unresampled aggregated data, exactly as
+        in hypothesis_test, so the output is identical to the interpreted loop
+        given the same random state.
+    """
+
+    @jit(nopython=True)
+    def _null_distribution_impl(
+        data, test, offsets, counts, bounds, start, first, last, permutations, out
+    ):
+        resample = test.copy()
+        labels = test[:, treatment_col].copy()
+        y = data[:, -1].copy()
+
+        for j in range(first, last):
+            # replicate 0 is the original data, the rest are bootstrapped.
+            # aggregated design is fixed, so only y needs to be recomputed
+            if j > 0:
+                resample[:, -1] = nb_weighted_groupby_mean(
+                    y, bootstrap(start), offsets, counts, bounds
+                )
+                resample[:, treatment_col] = labels
+
+            place = (j - first) * permutations
+            permutation_null(resample, out[place : place + permutations])
+
+    return _null_distribution_impl
+
+
+@lru_cache()
+def _permutation_null_factory(permute, teststat, treatment_col):
+    """Evaluates a test statistic on successive outputs of a Permuter.
+
+    Parameters
+    ----------
+    permute : jitted function
+        Fitted Permuter.transform.
+    teststat : jitted function
+        Test statistic from _test_stat_factory.
+    treatment_col : int
+
+    Returns
+    -------
+    function
+        Kernel that permutes an aggregated table in place once per element of
+        its output array and stores the test statistic of each permutation.
+    """
+
+    @jit(nopython=True)
+    def _permutation_null_impl(resample, out):
+        for k in range(out.size):
+            permute_resample = permute(resample)
+            out[k] = teststat(
+                permute_resample[:, treatment_col], permute_resample[:, -1]
+            )
+
+    return _permutation_null_impl
+
+
+@lru_cache()
+def _swap_null_factory(compare, treatment_labels, treatment_col):
+    """Enumerates every two-sample permutation with constant-time updates.
+
+    Both built-in test statistics only depend on the sum and sum of squares
+    of y within one sample when there are two samples. Combinations are
+    visited in revolving-door order (Knuth, TAOCP 7.2.1.3, Algorithm R), in
+    which consecutive combinations differ by one swapped pair, so those sums
+    are updated in O(1) rather than recomputed in O(n) per permutation.
+
+    Parameters
+    ----------
+    compare : {'means', 'corr'}
+    treatment_labels : tuple of two floats
+        Sorted labels in the treatment column.
+    treatment_col : int
+
+    Returns
+    -------
+    function
+        Kernel that fills its output array with the test statistic of every
+        distinct assignment of labels in an aggregated table. The first value
+        is always the statistic of the observed assignment.
+    """
+    label_a, label_b = treatment_labels
+
+    if compare == "means":
+
+        @jit(nopython=True)
+        def _stat(n, len_a, sum_a, sum_sq_a, total, total_sq):
+            return _welch_from_sums(n, len_a, sum_a, sum_sq_a, total, total_sq)
+
+    elif compare == "corr":
+
+        @jit(nopython=True)
+        def _stat(n, len_a, sum_a, sum_sq_a, total, total_sq):
+            return _studentized_covariance_from_sums(
+                n, len_a, sum_a, sum_sq_a, total, total_sq, label_a, label_b
+            )
+
+    else:
+        raise KeyError("No such comparison.")
+
+    @jit(nopython=True)
+    def _visit(chosen_a, n, t, sum_c, sum_sq_c, total, total_sq):
+        # sums are kept for the chosen sample, which may be either one
+        if chosen_a:
+            return _stat(n, t, sum_c, sum_sq_c, total, total_sq)
+        return _stat(n, n - t, total - sum_c, total_sq - sum_sq_c, total, total_sq)
+
+    @jit(nopython=True)
+    def _swap_null_impl(resample, out):
+        labels = resample[:, treatment_col]
+        y = resample[:, -1]
+        n = y.size
+
+        # center y so the running sums do not lose precision
+        mean_y = 0.0
+        for i in range(n):
+            mean_y += y[i]
+        mean_y /= n
+
+        dev = np.empty(n)
+        total = total_sq = 0.0
+        for i in range(n):
+            dev[i] = y[i] - mean_y
+            total += dev[i]
+            total_sq += dev[i] ** 2
+
+        # choose the smaller sample and put its observed members first, so the
+        # first combination visited is the observed assignment
+        len_a = 0
+        for i in range(n):
+            if labels[i] == label_a:
+                len_a += 1
+        chosen_a = len_a <= n - len_a
+        t = len_a if chosen_a else n - len_a
+
+        order = np.empty(n, dtype=np.int64)
+        head, tail = 0, t
+        for i in range(n):
+            if (labels[i] == label_a) == chosen_a:
+                order[head] = i
+                head += 1
+            else:
+                order[tail] = i
+                tail += 1
+
+        sum_c = sum_sq_c = 0.0
+        for i in range(t):
+            sum_c += dev[order[i]]
+            sum_sq_c += dev[order[i]] ** 2
+        out[0] = _visit(chosen_a, n, t, sum_c, sum_sq_c, total, total_sq)
+        place = 1
+
+        if t == 1:
+            for i in range(1, n):
+                sum_c = dev[order[i]]
+                sum_sq_c = sum_c**2
+                out[place] = _visit(chosen_a, n, t, sum_c, sum_sq_c, total, total_sq)
+                place += 1
+
+        elif t > 1:
+            # revolving-door combinations of positions in order. c is 1-indexed,
+            # as in Knuth, with a sentinel at c[t + 1]
+            c = np.empty(t + 2, dtype=np.int64)
+            for j in range(1, t + 1):
+                c[j] = j - 1
+            c[t + 1] = n
+
+            while True:
+                leave = enter = -1
+                j, state = 2, 0
+                if t % 2 == 1:
+                    if c[1] + 1 < c[2]:
+                        leave = c[1]
+                        c[1] += 1
+                        enter = c[1]
+                    else:
+                        state = 4
+                else:
+                    if c[1] > 0:
+                        leave = c[1]
+                        c[1] -= 1
+                        enter = c[1]
+                    else:
+                        state = 5
+
+                while leave < 0 and j <= t:
+                    if state == 4:
+                        # try to decrease c[j]
+                        if c[j] >= j:
+                            leave = c[j]
+                            enter = j - 2
+                            c[j] = c[j - 1]
+                            c[j - 1] = j - 2
+                        else:
+                            j += 1
+                            state = 5
+                    else:
+                        # try to increase c[j]
+                        if c[j] + 1 < c[j + 1]:
+                            leave = c[j - 1]
+                            c[j - 1] = c[j]
+                            c[j] += 1
+                            enter = c[j]
+                        else:
+                            j += 1
+                            state = 4
+
+                if leave < 0:
+                    break
+
+                if place % 64 == 0:
+                    # rounding error builds up in the running sums, so
+                    # recompute them from the combination every so often
+                    sum_c = sum_sq_c = 0.0
+                    for j in range(1, t + 1):
+                        sum_c += dev[order[c[j]]]
+                        sum_sq_c += dev[order[c[j]]] ** 2
+                else:
+                    v_out = dev[order[leave]]
+                    v_in = dev[order[enter]]
+                    sum_c += v_in - v_out
+                    sum_sq_c += v_in**2 - v_out**2
+                out[place] = _visit(chosen_a, n, t, sum_c, sum_sq_c, total, total_sq)
+                place += 1
+
+    return _swap_null_impl
+
+
+@lru_cache()
+def _parallel_null_distribution_factory(null_kernel):
+    """Spreads a kernel from _null_distribution_factory across threads.
+
+    Replicates are split into one contiguous block per seed and the numba
+    PRNG of the thread running each block is reseeded before it starts.
+    The output therefore only depends on the seeds, not on thread scheduling.
+    """
+
+    @jit(nopython=True, parallel=True)
+    def _parallel_null_distribution_impl(
+        data, test, offsets, counts, bounds, start, bootstraps, permutations, seeds, out
+    ):
+        n_jobs = seeds.size
+        for w in prange(n_jobs):
+            first = w * bootstraps // n_jobs
+            last = (w + 1) * bootstraps // n_jobs
+            set_numba_random_state(seeds[w])
+            null_kernel(
+                data,
+                test,
+                offsets,
+                counts,
+                bounds,
+                start,
+                first,
+                last,
+                permutations,
+                out[first * permutations : last * permutations],
+            )
+
+    return _parallel_null_distribution_impl
+
+
 def hypothesis_test(
     data_array,
     treatment_col,
@@ -251,6 +820,10 @@ def hypothesis_test(
     kind="weights",
     return_null=False,
     random_state=None,
+    n_jobs=None,
+    alpha=None,
+    tolerance=0.001,
+    hierarchy=None,
 ):
     """Two-tailed hierarchical permutation test for change in location
     with any number of samples.
@@ -262,7 +835,10 @@ def hypothesis_test(
     data_array : 2D numpy array or pandas DataFrame
         Array-like containing both the independent and dependent variables to
         be analyzed. It's assumed that the final (rightmost) column
-        contains the dependent variable values.
+        contains the dependent variable values. A np.memmap, such as from
+        np.load(path, mmap_mode="r"), must be numeric and lexicographically
+        sorted. If its final design column is in skip, it is averaged over in
+        chunks, so only the aggregated data is ever held in memory.
     treatment_col : int or str
         The index number of the column containing "two samples" to be compared.
         Indexing starts at 0. If input data is a pandas DataFrame, this can be
@@ -274,25 +850,55 @@ def hypothesis_test(
         The alternative hypothesis for the test, "two-sided" by default.
     skip : list of ints, optional
         Columns to skip in the bootstrap. Skip columns that were sampled
-        without replacement from the prior column, by default None
+        without replacement from the prior column, by default None. Skipped
+        columns below every resampled column are averaged over once, before
+        resampling.
     bootstraps : int, optional
         Number of bootstraps to perform, by default 100. Can be set to 1 for a
         permutation test without any bootstrapping.
-    permutations : int or "all", optional
+    permutations : int, "all" or "auto", optional
         Number of permutations to perform PER bootstrap sample. "all"
-        for exact test (only works if there are only two treatments), by default 1000
+        for exact test, which enumerates permutations within clusters if
+        treatment_col is not 0. "auto" enumerates every permutation if there
+        are no more than 1000 and performs 1000 random permutations otherwise,
+        by default 1000
     kind : str, optional
         Bootstrap algorithm - see Bootstrapper class, by default "weights"
     return_null : bool, optional
         Return the null distribution as well as the p value, by default False
     random_state : int or numpy random Generator, optional
         Seedable for reproducibility, by default None
+    n_jobs : int, optional
+        Number of independent random streams to split the bootstraps across,
+        each run on its own thread. -1 uses every thread available to numba.
+        Results are reproducible for a given random_state and n_jobs, but differ
+        from the serial result. Only supported for the built-in test statistics
+        and the "weights" or "bayesian" bootstrap, by default None (serial)
+    alpha : float, optional
+        Significance level for sequential testing. If given, the p-value is
+        checked after 1, 2, 4... bootstraps and resampling stops once it is
+        clearly above or below alpha. Not compatible with n_jobs, by default
+        None (run every bootstrap)
+    tolerance : float, optional
+        Sequential testing stops when a normal confidence interval at this
+        level around the p-value excludes alpha, by default 0.001
+    hierarchy : Hierarchy, optional
+        Precomputed Hierarchy of the preprocessed data, which can be reused
+        between tests on the same design, by default None
 
     Returns
     -------
     float64
         p-value for the hypothesis test
 
+    int
+        Number of resamples used to calculate the p-value. Only returned if
+        alpha is given.
+
+    float64
+        Monte Carlo standard error of the p-value. Only returned if alpha
+        is given.
+
     list
         Empirical null distribution used to calculate the p-value
 
@@ -300,6 +906,9 @@ def hypothesis_test(
     ------
     TypeError
         Raised if input data is not ndarray or DataFrame.
+    ValueError
+        Raised if alpha or tolerance is not between 0 and 1, or if hierarchy
+        does not describe the preprocessed data.
     KeyError
         If comparison is a string, it must be in the TEST_STATISTICS dictionary.
     AttributeError
@@ -355,8 +964,11 @@ def hypothesis_test(
 
     """
 
-    # turns the input array or dataframe into a float64 array
-    if isinstance(data_array, (np.ndarray, pd.DataFrame)):
+    # turns the input array or dataframe into a float64 array. memory-mapped
+    # arrays stay on disk until it is known whether they can be aggregated
+    if isinstance(data_array, np.memmap):
+        data = data_array
+    elif isinstance(data_array, (np.ndarray, pd.DataFrame)):
         if isinstance(data_array, pd.DataFrame) and isinstance(treatment_col, str):
             treatment_col = int(data_array.columns.get_loc(treatment_col))
         data = _preprocess_data(data_array)
@@ -366,28 +978,29 @@ def hypothesis_test(
     # set random state
     rng = np.random.default_rng(random_state)
 
-    # enforce lower bound on skip
-    if skip is not None:
-        skip = list(skip)
-        for v in reversed(skip):
-            if v <= treatment_col + 1:
-                warn("No need to include columns before treated columns in skip.")
-                skip.remove(v)
-    else:
-        skip = []
+    # the sequential stopping rule needs both levels strictly inside (0, 1)
+    if alpha is not None and not 0 < alpha < 1:
+        raise ValueError("alpha must be between 0 and 1.")
+    if not 0 < tolerance < 1:
+        raise ValueError("tolerance must be between 0 and 1.")
+
+    data, skip, hierarchy = _collapse_skipped(data, treatment_col, skip, hierarchy)
 
     # enforce bounds on bootstraps and permutations
-    if not isinstance(bootstraps, int) or bootstraps < 1:
-        raise TypeError("bootstraps must be an integer greater than 0")
-    if isinstance(permutations, str):
-        if permutations != "all":
-            raise TypeError("permutations must be 'all' or an integer greater than 0")
-    elif not isinstance(permutations, int) or permutations < 1:
-        raise TypeError("permutations must be 'all' or an integer greater than 0")
+    _check_resamples(bootstraps, permutations)
+    if n_jobs is not None:
+        if not isinstance(n_jobs, int) or (n_jobs < 1 and n_jobs != -1):
+            raise TypeError("n_jobs must be -1 or an integer greater than 0")
+        if n_jobs == -1:
+            n_jobs = numba.config.NUMBA_NUM_THREADS
+
+    # identify the clusters once and share them between every fit
+    if hierarchy is None:
+        hierarchy = Hierarchy(data)
 
     # initialize and fit the bootstrapper to the data
     bootstrapper = Bootstrapper(random_state=rng, kind=kind)
-    bootstrapper.fit(data, skip=skip)
+    bootstrapper.fit(data, skip=skip, hierarchy=hierarchy)
 
     # fetch test statistic from dictionary or, if given a custom test
     # statistic, make sure it is callable
@@ -401,7 +1014,7 @@ def hypothesis_test(
     # aggregate our data up to the treated level and determine the
     # observed test statistic
     aggregator = GroupbyMean()
-    aggregator.fit(data)
+    aggregator.fit(data, hierarchy=hierarchy)
 
     # determine the number of groupby reductions need to be done
     levels_to_agg = data.shape[1] - treatment_col - 3
@@ -418,63 +1031,391 @@ def hypothesis_test(
     truediff = teststat(test[:, treatment_col], test[:, -1])
 
     # initialize and fit the permuter to the aggregated data
+    permuter, permutations = _fit_permuter(
+        test, treatment_col, permutations, hierarchy.collapse(levels_to_agg)
+    )
+    exact = permuter.exact
+
+    # initialize the null distribution
+    null_distribution = np.empty(bootstraps * permutations)
+
+    compiled = isinstance(compare, str) and kind in ("weights", "bayesian")
+
+    if compiled and exact:
+        treatment_labels = np.unique(test[:, treatment_col])
+        if treatment_col == 0 and treatment_labels.size == 2:
+            # two-sample exact tests only need running sums of y
+            permutation_null = _swap_null_factory(
+                compare, tuple(treatment_labels.tolist()), treatment_col
+            )
+        else:
+            compiled = False
+
+    elif compiled:
+        permutation_null = _permutation_null_factory(
+            permuter.transform, teststat, treatment_col
+        )
+
+    if n_jobs is not None and (not compiled or alpha is not None):
+        simplefilter("always", UserWarning)
+        warn("n_jobs is not supported for this test. Running serially.")
+        n_jobs = None
+
+    def _bootstrap():
+        # generate a bootstrapped sample and aggregate it up to the treated
+        # level. resampled rows are grouped using the weights that repeated them
+        if kind == "indexes":
+            weights = bootstrapper.weights(start=treatment_col + 2)
+            return aggregator.transform(
+                data[weights_to_index(weights)],
+                iterations=levels_to_agg,
+                weights=weights,
+            )
+        return aggregator.transform(
+            bootstrapper.transform(data, start=treatment_col + 2),
+            iterations=levels_to_agg,
+        )
+
+    # each branch defines how to fill in the null distribution for a range
+    # of bootstraps. bootstrap 0 is always the original data, as this helps
+    # to prevent getting a p-value of 0
+    if compiled:
+        # the design never changes under reweighting, so the whole resampling
+        # loop can run inside a single compiled kernel
+        null_kernel = _null_distribution_factory(
+            bootstrapper.weights, permutation_null, treatment_col
+        )
+        offsets = aggregator.fixed_offsets(levels_to_agg)
+
+        def _fill(first, last):
+            null_kernel(
+                data,
+                test,
+                *offsets,
+                treatment_col + 2,
+                first,
+                last,
+                permutations,
+                null_distribution[first * permutations : last * permutations],
+            )
+
+    elif isinstance(compare, str):
+        # evaluate each bootstrap's permutations in one batch. the observed
+        # statistic is recomputed with the batched function so that it ties
+        # exactly with the identity permutation
+        batch_stat = _batch_stat_factory(
+            tuple(data[:, treatment_col].tolist()), compare
+        )
+        truediff = batch_stat(test[:, treatment_col].reshape((1, -1)), test[:, -1])[0]
+
+        def _fill(first, last):
+            for j in range(first, last):
+                if j == 0:
+                    bootstrapped_sample = test
+                else:
+                    bootstrapped_sample = _bootstrap()
+                _batch_null(
+                    permuter,
+                    batch_stat,
+                    bootstrapped_sample,
+                    null_distribution[j * permutations : (j + 1) * permutations],
+                )
+
+    else:
+        # skip the dot on the permute function
+        call_permute = permuter.transform
+
+        def _fill(first, last):
+            for j in range(first, last):
+                if j == 0:
+                    bootstrapped_sample = test
+                else:
+                    bootstrapped_sample = _bootstrap()
+
+                # generate permuted samples, calculate test statistic,
+                # store in null distribution
+                for k in range(j * permutations, (j + 1) * permutations):
+                    permute_resample = call_permute(bootstrapped_sample)
+                    null_distribution[k] = teststat(
+                        permute_resample[:, treatment_col], permute_resample[:, -1]
+                    )
+
+    if alpha is None:
+        schedule = [bootstraps]
+    else:
+        # look at the decision after 1, 2, 4... bootstraps
+        schedule = [2**i for i in range(int(np.log2(bootstraps)) + 1)]
+        if schedule[-1] < bootstraps:
+            schedule.append(bootstraps)
+        z = NormalDist().inv_cdf(1 - tolerance / 2)
+
+    done = 0
+    for last in schedule:
+        if n_jobs is None:
+            _fill(done, last)
+
+        else:
+            # each block of bootstraps gets its own reproducible random stream
+            seeds = rng.integers(low=2**32 - 1, size=n_jobs)
+            threads = numba.get_num_threads()
+            numba.set_num_threads(min(n_jobs, numba.config.NUMBA_NUM_THREADS))
+            try:
+                _parallel_null_distribution_factory(null_kernel)(
+                    data,
+                    test,
+                    *offsets,
+                    treatment_col + 2,
+                    bootstraps,
+                    permutations,
+                    seeds,
+                    null_distribution,
+                )
+            finally:
+                numba.set_num_threads(threads)
+
+        if compiled and exact:
+            # the first enumerated assignment is the observed one. using it as
+            # the observed statistic keeps the exact tie with the identity
+            truediff = null_distribution[0]
+
+        done = last
+        total = done * permutations
+        pval = _p_value(truediff, null_distribution[:total], alternative)
+
+        if alpha is not None:
+            std_error = _monte_carlo_error(pval, total, alternative)
+            if abs(pval - alpha) > z * std_error:
+                break
+
+    if alpha is not None:
+        if return_null is True:
+            return pval, total, std_error, null_distribution[:total].tolist()
+        return pval, total, std_error
+
+    if return_null is True:
+        return pval, null_distribution.tolist()
+
+    else:
+        return pval
+
+
+def _collapse_skipped(data, treatment_col, skip, hierarchy):
+    """Drops skip columns that are never resampled and averages over the
+    skipped lowest levels.
+
+    Parameters
+    ----------
+    data : 2D array or np.memmap
+    treatment_col : int
+    skip : list of ints or None
+    hierarchy : Hierarchy or None
+
+    Returns
+    -------
+    data : 2D array
+        Data with every skipped lowest level averaged over.
+    skip : list of ints
+        Remaining columns to skip in the bootstrap.
+    hierarchy : Hierarchy or None
+        hierarchy collapsed to match data, if given.
+    """
+    skip = _check_skip(treatment_col, skip)
+
+    # the lowest levels are never resampled if they are skipped, so average
+    # over them once here rather than on every bootstrap
+    collapse = 0
+    while data.shape[1] - 2 - collapse in skip:
+        skip.remove(data.shape[1] - 2 - collapse)
+        collapse += 1
+
+    if isinstance(data, np.memmap):
+        if collapse:
+            # the first reduction is done in chunks, so all of data is never
+            # read into memory at once
+            data = chunked_groupby_mean(data)
+            collapse -= 1
+            if hierarchy is not None:
+                hierarchy = hierarchy.collapse(1)
+        else:
+            data = _preprocess_data(np.asarray(data))
+
+    # a Hierarchy of some other design would give silently wrong clusters
+    if hierarchy is not None and not hierarchy.matches(data):
+        raise ValueError("hierarchy does not match the preprocessed data.")
+
+    if collapse:
+        if hierarchy is None:
+            hierarchy = Hierarchy(data)
+        grouper = GroupbyMean()
+        grouper.fit(data, hierarchy=hierarchy)
+        data = grouper.transform(data, iterations=collapse)
+        hierarchy = hierarchy.collapse(collapse)
+
+    return data, skip, hierarchy
+
+
+def _check_skip(treatment_col, skip):
+    """Enforce lower bound on skip and return it as a new list."""
+    if skip is None:
+        return []
+    skip = list(skip)
+    for v in reversed(skip):
+        if v <= treatment_col + 1:
+            warn("No need to include columns before treated columns in skip.")
+            skip.remove(v)
+    return skip
+
+
+def _check_resamples(bootstraps, permutations):
+    """Enforce bounds on bootstraps and permutations."""
+    if not isinstance(bootstraps, int) or bootstraps < 1:
+        raise TypeError("bootstraps must be an integer greater than 0")
+    if isinstance(permutations, str):
+        if permutations not in ("all", "auto"):
+            raise TypeError(
+                "permutations must be 'all', 'auto' or an integer greater than 0"
+            )
+    elif not isinstance(permutations, int) or permutations < 1:
+        raise TypeError(
+            "permutations must be 'all', 'auto' or an integer greater than 0"
+        )
+
+
+def _fit_permuter(test, treatment_col, permutations, hierarchy):
+    """Fits a Permuter to aggregated data.
+
+    Parameters
+    ----------
+    test : 2D array
+        Data aggregated up to the treated level.
+    treatment_col : int
+    permutations : int, "all" or "auto"
+    hierarchy : Hierarchy
+        Hierarchy of test.
+
+    Returns
+    -------
+    permuter : Permuter
+    permutations : int
+        Number of permutations to draw from each bootstrapped sample.
+    """
     # don't need to seed this, as numba's PRNG state is shared
     permuter = Permuter()
 
     if permutations == "all":
-        permuter.fit(test, treatment_col, exact=True)
+        permuter.fit(test, treatment_col, exact=True, hierarchy=hierarchy)
 
-        # in the exact case, determine and set the total number of
-        # possible permutations
-        counts = np.unique(test[:, 0], return_counts=True)[1]
-        permutations = _binomial(counts.sum(), counts[0])
+    elif permutations == "auto":
+        # only enumerate the permutations if there are few of them
+        permuter.fit(
+            test, treatment_col, exact="auto", budget=1000, hierarchy=hierarchy
+        )
 
     else:
         # just fit the permuter if this is a randomized test
-        permuter.fit(test, treatment_col)
+        permuter.fit(test, treatment_col, hierarchy=hierarchy)
 
-    # skip the dot on the permute function
-    call_permute = permuter.transform
+    if permuter.exact:
+        # in the exact case, determine and set the total number of
+        # possible permutations
+        permutations = permuter.n_permutations
+    elif permutations == "auto":
+        permutations = 1000
 
-    # initialize empty null distribution list
-    null_distribution = []
-    total = bootstraps * permutations
+    return permuter, permutations
 
-    # first set of permutations is on the original data
-    # this helps to prevent getting a p-value of 0
-    for k in range(permutations):
-        permute_resample = call_permute(test)
-        null_distribution.append(
-            teststat(permute_resample[:, treatment_col], permute_resample[:, -1])
-        )
 
-    # already did one set of permutations
-    bootstraps -= 1
+def _fit_resamplers(
+    data, treatment_col, skip, bootstraps, permutations, kind, random_state, hierarchy
+):
+    """Fits the Bootstrapper and GroupbyMean for tests that draw every
+    bootstrapped sample themselves and reuse it.
 
-    for j in range(bootstraps):
-        # generate a bootstrapped sample and aggregate it up to the
-        # treated level
-        bootstrapped_sample = bootstrapper.transform(data, start=treatment_col + 2)
-        bootstrapped_sample = aggregator.transform(
-            bootstrapped_sample, iterations=levels_to_agg
-        )
+    Parameters
+    ----------
+    data : 2D array
+        Preprocessed data.
+    treatment_col : int
+    skip : list of ints or None
+    bootstraps : int
+    permutations : int, "all" or "auto"
+    kind : str
+        Bootstrap algorithm - see Bootstrapper class.
+    random_state : int or numpy random Generator
+    hierarchy : Hierarchy or None
+        Hierarchy of data, if already known.
+
+    Returns
+    -------
+    data : 2D array
+        Data with every skipped lowest level averaged over.
+    hierarchy : Hierarchy
+        Hierarchy of data.
+    bootstrapper : Bootstrapper
+    aggregator : GroupbyMean
+    levels_to_agg : int
+        Number of reductions from data to the treated level.
+    bootstraps : int
+        Number of bootstraps to draw, which is 1 if there are no levels to
+        bootstrap.
+    test : 2D array
+        Data aggregated up to the treated level.
+    """
+    rng = np.random.default_rng(random_state)
 
-        # generate permuted samples, calculate test statistic,
-        # append to null distribution
+    data, skip, hierarchy = _collapse_skipped(data, treatment_col, skip, hierarchy)
+    _check_resamples(bootstraps, permutations)
 
-        for k in range(permutations):
-            permute_resample = call_permute(bootstrapped_sample)
-            null_distribution.append(
-                teststat(permute_resample[:, treatment_col], permute_resample[:, -1])
-            )
+    if hierarchy is None:
+        hierarchy = Hierarchy(data)
+
+    bootstrapper = Bootstrapper(random_state=rng, kind=kind)
+    bootstrapper.fit(data, skip=skip, hierarchy=hierarchy)
+
+    aggregator = GroupbyMean()
+    aggregator.fit(data, hierarchy=hierarchy)
+
+    levels_to_agg = data.shape[1] - treatment_col - 3
+
+    if (levels_to_agg - len(skip)) == 0 and bootstraps > 1:
+        bootstraps = 1
+        simplefilter("always", UserWarning)
+        warn("No levels to bootstrap. Setting bootstraps to zero.")
+
+    test = aggregator.transform(data, iterations=levels_to_agg)
+
+    return data, hierarchy, bootstrapper, aggregator, levels_to_agg, bootstraps, test
+
+
+def _p_value(truediff, null_distribution, alternative, rtol=1e-10):
+    """Calculates a p-value from an empirical null distribution.
+
+    Parameters
+    ----------
+    truediff : float
+        Observed test statistic.
+    null_distribution : 1D array
+    alternative : {"two-sided", "less", "greater"}
+    rtol : float, optional
+        Null statistics within this tolerance of truediff, relative to the
+        largest statistic in absolute value, count as ties, by default 1e-10
+
+    Returns
+    -------
+    float
+        p-value, which is never less than 1 / len(null_distribution).
+    """
+    total = null_distribution.size
+
+    # permutations that tie with the observed one, such as those that only
+    # swap units with equal values, give the same statistic up to rounding
+    # error. count them as ties rather than as more or less extreme. the
+    # error scales with the statistics, not with truediff, which may be 0
+    gamma = rtol * max(np.abs(truediff), np.nanmax(np.abs(null_distribution)))
 
     # generate both one-tailed p-values, then two-tailed
-    p_less = np.where(truediff >= np.array(null_distribution))[0].size / len(
-        null_distribution
-    )
-    p_greater = np.where(truediff <= np.array(null_distribution))[0].size / len(
-        null_distribution
-    )
+    p_less = np.count_nonzero(null_distribution <= truediff + gamma) / total
+    p_greater = np.count_nonzero(null_distribution >= truediff - gamma) / total
     p_two = 2 * np.min((p_less, p_greater))
 
     if alternative == "two-sided":
@@ -487,11 +1428,28 @@ def hypothesis_test(
     if pval == 0:
         pval += 1 / (total)
 
-    if return_null is True:
-        return pval, null_distribution
+    return pval
 
-    else:
-        return pval
+
+def _monte_carlo_error(pval, total, alternative):
+    """Binomial standard error of a p-value estimated from total resamples.
+
+    Parameters
+    ----------
+    pval : float
+    total : int
+        Size of the empirical null distribution.
+    alternative : {"two-sided", "less", "greater"}
+
+    Returns
+    -------
+    float
+    """
+    if alternative == "two-sided":
+        # a two-sided p-value is twice a tail proportion
+        tail = min(pval / 2, 0.5)
+        return 2 * np.sqrt(tail * (1 - tail) / total)
+    return np.sqrt(pval * (1 - pval) / total)
 
 
 def multi_sample_test(
@@ -505,6 +1463,7 @@ def multi_sample_test(
     permutations=1000,
     kind="weights",
     random_state=None,
+    shared_resamples=False,
 ):
     """Two-tailed multiple-sample hierarchical permutation test.
 
@@ -528,20 +1487,41 @@ def multi_sample_test(
     correction : str, optional
         Multiple comparisons question to be performed after p-values are
         calculated. 'fdr' performs the Benjamini-Hochberg procedure for
-        controlling False Discovery Rate, by default "fdr"
+        controlling False Discovery Rate, by default "fdr". 'maxt' performs
+        the Westfall-Young step-down max-T procedure for controlling
+        Family-Wise Error Rate. Every comparison is tested on the same
+        bootstrapped samples, as with shared_resamples, and the treatment
+        labels of every unit in the compared conditions are permuted together,
+        so every comparison in a resample comes from the same relabelled
+        sample. The adjusted p-value of a comparison comes from the largest
+        absolute null statistic, resample by resample, among it and every
+        comparison with a smaller observed statistic, so the correlation
+        between comparisons is taken into account. With 'maxt', "all"
+        enumerates the relabellings of every compared unit and the output
+        is sorted by the absolute observed statistic, largest first.
     compare : function or str, optional
         The comparison to use to perform the hypothesis test, by default "means"
     skip : list of ints, optional
         Columns to skip in the bootstrap, by default None
     bootstraps : int, optional
         Number of bootstraps to perform, by default 100
-    permutations : int or "all"
+    permutations : int, "all" or "auto"
         Number of permutations to perform PER bootstrap sample. "all"
-        for exact test, by default 1000
+        for exact test. "auto" enumerates every permutation if there are no
+        more than 1000 and performs 1000 random permutations otherwise, by
+        default 1000
     kind : str, optional
         Bootstrapper algorithm. See Bootstrapper class, by default "weights"
     seed : int or numpy.random.Generator instance, optional
         Seedable for reproducibility, by default None
+    shared_resamples : bool, optional
+        Bootstrap and aggregate the full dataset once per bootstrap and test
+        every comparison on the same aggregated samples, rather than running
+        a separate hypothesis test on the data from each pair of conditions,
+        by default False. The cost of resampling is paid once however many
+        comparisons there are, but the p-values of different comparisons
+        are no longer independent draws. The 'maxt' correction always
+        shares resamples.
 
     Returns
     -------
@@ -658,13 +1638,49 @@ def multi_sample_test(
     1         2.0         4.0  0.1506            0.2259
     2         2.0         1.0  0.4036            0.4036
 
+    With many conditions, bootstrapping the full dataset once and testing every
+    comparison on the same bootstrapped samples is much faster than running a
+    separate test for each pair, and gives very similar p-values.
+
+    >>> multi_sample_test(data, treatment_col=0, hypotheses="all",
+    ...                   correction=None, bootstraps=1000,
+    ...                   permutations="all", random_state=111,
+    ...                   shared_resamples=True)
+      Condition 1 Condition 2 p-value
+    0         2.0         3.0  0.0365
+    1         3.0         4.0  0.0399
+    2         1.0         3.0  0.0407
+    3         2.0         4.0  0.1493
+    4         1.0         2.0  0.3999
+    5         1.0         4.0  0.4559
+
+    The Westfall-Young max-T procedure controls the Family-Wise Error Rate. It
+    permutes the treatment labels of every unit at once and computes every
+    comparison from the same relabelled samples, so it takes the correlation
+    between the comparisons into account when adjusting them. Its p-values
+    come from this joint null distribution rather than from the units of
+    each pair alone.
+
+    >>> multi_sample_test(data, treatment_col=0, hypotheses="all",
+    ...                   correction='maxt', bootstraps=100,
+    ...                   permutations=1000, random_state=111)
+      Condition 1 Condition 2  p-value Corrected p-value
+    0         3.0         4.0  0.00174           0.00792
+    1         1.0         3.0  0.00332           0.01164
+    2         2.0         3.0  0.00542            0.0148
+    3         2.0         4.0  0.12746             0.291
+    4         1.0         2.0  0.45994           0.67245
+    5         1.0         4.0  0.49726           0.67245
+
 
     """
 
     MULTIPLE_COMPARISONS_CORRECTIONS = {
         "fdr": _false_discovery_adjust,
     }
-    if correction is not None:
+    # these corrections need the joint null distribution of every comparison
+    RESAMPLING_CORRECTIONS = ("maxt",)
+    if correction is not None and correction not in RESAMPLING_CORRECTIONS:
         try:
             multiple_correction = MULTIPLE_COMPARISONS_CORRECTIONS[correction]
         except KeyError:
@@ -700,16 +1716,41 @@ def multi_sample_test(
     else:
         output = _get_comparisons(data, treatment_col)
 
-    # perform a two_sample_test for each comparison
-    # no option to return null distributions because that would be a hassle
-    for i in range(len(output)):
-        test_idx = np.logical_or(
-            (data[:, treatment_col] == output[i, 0]),
-            (data[:, treatment_col] == output[i, 1]),
+    if shared_resamples or correction in RESAMPLING_CORRECTIONS:
+        # label-encode the full dataset once and translate the hypotheses
+        encoded, labels = _preprocess_data(data, return_labels=True)
+        if treatment_col in labels:
+            codes = {label: code for code, label in enumerate(labels[treatment_col])}
+            pairs = [(codes[a], codes[b]) for a, b in output[:, :2]]
+        else:
+            pairs = [(float(a), float(b)) for a, b in output[:, :2]]
+
+    if correction in RESAMPLING_CORRECTIONS:
+        truediffs, nulls = _joint_pairwise_nulls(
+            encoded,
+            treatment_col,
+            pairs,
+            compare=compare,
+            skip=skip,
+            bootstraps=bootstraps,
+            permutations=permutations,
+            kind=kind,
+            random_state=random_state,
+        )
+        pvals = np.array(
+            [
+                _p_value(truediff, null, "two-sided")
+                for truediff, null in zip(truediffs, nulls.T)
+            ]
         )
-        output[i, 2] = hypothesis_test(
-            data[test_idx],
-            treatment_col=treatment_col,
+        output[:, 2] = pvals
+        q_vals = _max_t_adjust(np.abs(nulls), np.abs(truediffs), pvals)
+
+    elif shared_resamples:
+        truediffs, nulls = _shared_pairwise_nulls(
+            encoded,
+            treatment_col,
+            pairs,
             compare=compare,
             skip=skip,
             bootstraps=bootstraps,
@@ -717,14 +1758,45 @@ def multi_sample_test(
             kind=kind,
             random_state=random_state,
         )
+        output[:, 2] = [
+            _p_value(truediff, null, "two-sided")
+            for truediff, null in zip(truediffs, nulls)
+        ]
+
+    else:
+        # perform a two_sample_test for each comparison
+        # no option to return null distributions because that would be a hassle
+        for i in range(len(output)):
+            test_idx = np.logical_or(
+                (data[:, treatment_col] == output[i, 0]),
+                (data[:, treatment_col] == output[i, 1]),
+            )
+            output[i, 2] = hypothesis_test(
+                data[test_idx],
+                treatment_col=treatment_col,
+                compare=compare,
+                skip=skip,
+                bootstraps=bootstraps,
+                permutations=permutations,
+                kind=kind,
+                random_state=random_state,
+            )
 
-    # sort the output array so that smallest p-values are on top
-    ordered_idx = output[:, -1].argsort()
+    if correction in RESAMPLING_CORRECTIONS:
+        # the step-down visits comparisons from the largest observed statistic
+        # down, and the adjusted p-values increase in that order
+        ordered_idx = np.argsort(-np.abs(truediffs), kind="stable")
+    else:
+        # sort the output array so that smallest p-values are on top
+        ordered_idx = output[:, -1].argsort()
     output = output[ordered_idx]
 
     # perform multiple comparisons correction, if any
-    if correction is not None:
+    if correction in RESAMPLING_CORRECTIONS:
+        q_vals = q_vals[ordered_idx]
+    elif correction is not None:
         q_vals = multiple_correction(output[:, -1])
+    if correction is not None:
         out = np.empty((output.shape[0], output.shape[1] + 1), dtype="object")
         out[:, :-1] = output
         out[:, -1] = q_vals
@@ -739,53 +1811,271 @@ def multi_sample_test(
     return output
 
 
-def _get_comparisons(data, treatment_col: int):
-    """Generates a list of pairwise comparisons for a k-sample test.
+def _shared_pairwise_nulls(
+    data,
+    treatment_col,
+    pairs,
+    compare,
+    skip,
+    bootstraps,
+    permutations,
+    kind,
+    random_state,
+):
+    """Null distributions of pairwise comparisons that share bootstrapped
+    samples.
+
+    Bootstrapping only resamples the levels below the treated units, so the
+    units of a pair of conditions are bootstrapped the same way whether or
+    not the rest of the data is present. Each bootstrapped sample of the
+    full dataset is aggregated once, then the units of each pair are
+    permuted within it.
 
     Parameters
     ----------
-    data : 2D array or pandas DataFrame
-        Target data.
+    data : 2D array
+        Preprocessed data.
     treatment_col : int
-        Target column.
+    pairs : list of two-element tuples
+        Encoded labels of the conditions in each comparison.
+    compare, skip, bootstraps, permutations, kind, random_state
+        See hypothesis_test.
 
     Returns
     -------
-    list of lists
-        list of two-member lists containing each pairwise comparison.
+    list of floats
+        Observed statistic of each comparison.
+    list of 1D arrays
+        Null distribution of each comparison.
     """
+    fitted = _fit_resamplers(
+        data, treatment_col, skip, bootstraps, permutations, kind, random_state, None
+    )
+    data, hierarchy, bootstrapper, aggregator, levels_to_agg, bootstraps, test = fitted
 
-    if isinstance(data, pd.DataFrame):
-        data = data.to_numpy()
+    # fit a permuter and test statistic to the units of each pair
     comparisons = []
-    for i, j in combinations(np.unique(data[:, treatment_col]), 2):
-        comparisons.append([i, j])
-    comparisons = np.array(comparisons, dtype="object")
-    out = np.empty((comparisons.shape[0], comparisons.shape[1] + 1), dtype="object")
-    out[:, :-1] = comparisons
-    return out
+    for pair in pairs:
+        sample = test[np.isin(test[:, treatment_col], pair)]
+        permuter, n_permutations = _fit_permuter(
+            sample, treatment_col, permutations, None
+        )
+        if compare == "means":
+            # share one compiled statistic between every pair rather than
+            # compiling one for each pair of labels
+            def batch_stat(X, y, label=float(min(pair))):
+                return welch_statistic_batch(X, y, label)
+
+        elif isinstance(compare, str):
+            batch_stat = _batch_stat_factory(
+                tuple(sample[:, treatment_col].tolist()), compare
+            )
+        elif callable(compare):
+
+            def batch_stat(X, y, compare=compare):
+                return np.array([compare(x, y) for x in X])
+
+        else:
+            raise AttributeError("Custom test statistics must be callable.")
+
+        observed = sample[:, treatment_col].reshape((1, -1))
+        truediff = batch_stat(observed, sample[:, -1])[0]
+        null = np.empty(bootstraps * n_permutations)
+        comparisons.append((pair, permuter, batch_stat, truediff, null))
+
+    for j in range(bootstraps):
+        # bootstrap 0 is always the original data
+        if j == 0:
+            bootstrapped_sample = test
+        else:
+            weights = bootstrapper.weights(start=treatment_col + 2)
+            bootstrapped_sample = _aggregate_resample(
+                aggregator, data, weights, levels_to_agg, kind
+            )
+
+        for pair, permuter, batch_stat, _, null in comparisons:
+            in_pair = np.isin(bootstrapped_sample[:, treatment_col], pair)
+            n_permutations = null.size // bootstraps
+            _batch_null(
+                permuter,
+                batch_stat,
+                bootstrapped_sample[in_pair],
+                null[j * n_permutations : (j + 1) * n_permutations],
+            )
 
+    truediffs = [truediff for _, _, _, truediff, _ in comparisons]
+    nulls = [null for _, _, _, _, null in comparisons]
+    return truediffs, nulls
 
-def _binomial(x: int, y: int):
-    """Calculates a binomial coefficient.
+
+def _joint_pairwise_nulls(
+    data,
+    treatment_col,
+    pairs,
+    compare,
+    skip,
+    bootstraps,
+    permutations,
+    kind,
+    random_state,
+    chunk=1024,
+):
+    """Joint null distribution of pairwise comparisons.
+
+    Each bootstrapped sample is aggregated once, then the treatment labels of
+    every unit in the compared conditions are permuted together, and every
+    comparison is computed from the same relabelled sample. So each row of
+    the null distribution keeps the correlation between comparisons that
+    share a condition.
 
     Parameters
     ----------
-    x : int
-        Total number of elements
-    y : int
-        Elements to choose
+    data : 2D array
+        Preprocessed data.
+    treatment_col : int
+    pairs : list of two-element tuples
+        Encoded labels of the conditions in each comparison.
+    compare, skip, bootstraps, permutations, kind, random_state
+        See hypothesis_test.
+    chunk : int, optional
+        Largest number of permutations to generate at a time, by default 1024
 
     Returns
     -------
-    int
-        x choose y
+    1D array
+        Observed statistic of each comparison.
+    2D array
+        Null statistics, with one row per resample and one column per
+        comparison.
+    """
+    pairs = [(float(a), float(b)) for a, b in pairs]
+
+    # the labels of conditions that are never compared are left out, so
+    # permuting them cannot dilute the null distribution
+    compared = np.unique(pairs)
+    data = data[np.isin(data[:, treatment_col], compared)]
+
+    fitted = _fit_resamplers(
+        data, treatment_col, skip, bootstraps, permutations, kind, random_state, None
+    )
+    data, hierarchy, bootstrapper, aggregator, levels_to_agg, bootstraps, test = fitted
+    permuter, n_permutations = _fit_permuter(
+        test, treatment_col, permutations, hierarchy.collapse(levels_to_agg)
+    )
+
+    if isinstance(compare, str):
+        pair_stat = _pairwise_stat_factory(compare)
+    elif callable(compare):
+
+        def pair_stat(X, y, pair, compare=compare):
+            out = np.empty(X.shape[0])
+            for j, x in enumerate(X):
+                in_pair = np.isin(x, pair)
+                out[j] = compare(x[in_pair], y[in_pair])
+            return out
+
+    else:
+        raise AttributeError("Custom test statistics must be callable.")
+
+    observed = test[:, treatment_col].reshape((1, -1))
+    truediffs = np.array([pair_stat(observed, test[:, -1], pair)[0] for pair in pairs])
+    nulls = np.empty((bootstraps * n_permutations, len(pairs)))
+
+    for j in range(bootstraps):
+        # bootstrap 0 is always the original data
+        if j == 0:
+            bootstrapped_sample = test
+        else:
+            weights = bootstrapper.weights(start=treatment_col + 2)
+            bootstrapped_sample = _aggregate_resample(
+                aggregator, data, weights, levels_to_agg, kind
+            )
+
+        for first in range(0, n_permutations, chunk):
+            last = min(first + chunk, n_permutations)
+            X = permuter.transform_batch(bootstrapped_sample, last - first)
+            rows = slice(j * n_permutations + first, j * n_permutations + last)
+            for i, pair in enumerate(pairs):
+                nulls[rows, i] = pair_stat(X, bootstrapped_sample[:, -1], pair)
+
+    return truediffs, nulls
+
+
+def _max_t_adjust(null_distribution, observed, unadjusted=None, rtol=1e-10):
+    """Westfall-Young step-down max-T adjustment of p-values.
+
+    Comparisons are visited from the largest observed statistic down. Each is
+    compared to the largest null statistic, within each resample, among
+    itself and every comparison with a smaller observed statistic. The
+    adjusted p-values are then made to increase in that order.
+
+    Parameters
+    ----------
+    null_distribution : 2D array
+        Absolute null statistics, with one row per resample and one column
+        per comparison.
+    observed : 1D array
+        Absolute observed statistic of each comparison.
+    unadjusted : 1D array, optional
+        Unadjusted p-value of each comparison, which its adjusted p-value is
+        never less than, by default None
+    rtol : float, optional
+        As in _p_value, by default 1e-10
+
+    Returns
+    -------
+    1D array
+        Adjusted p-value of each comparison, which is never less than
+        1 / len(null_distribution). They do not decrease in the order of
+        np.argsort(-observed, kind="stable").
+    """
+    total = len(null_distribution)
+
+    # as in _p_value, null statistics that tie with an observed statistic up
+    # to rounding error count as at least as extreme
+    gamma = rtol * max(np.nanmax(observed), np.nanmax(null_distribution))
+
+    order = np.argsort(-observed, kind="stable")
+    least_significant_first = null_distribution[:, order[::-1]]
+    successive_max = np.maximum.accumulate(least_significant_first, axis=1)[:, ::-1]
+    adjusted = (successive_max >= observed[order] - gamma).sum(axis=0) / total
+
+    # as in _p_value, the p-value can never be less than 1 / total
+    adjusted = np.maximum(adjusted, 1 / total)
+    if unadjusted is not None:
+        adjusted = np.maximum(adjusted, unadjusted[order])
+    adjusted = np.maximum.accumulate(adjusted)
+
+    adjusted_pvals = np.empty(observed.size)
+    adjusted_pvals[order] = adjusted
+    return adjusted_pvals
+
+
+def _get_comparisons(data, treatment_col: int):
+    """Generates a list of pairwise comparisons for a k-sample test.
+
+    Parameters
+    ----------
+    data : 2D array or pandas DataFrame
+        Target data.
+    treatment_col : int
+        Target column.
+
+    Returns
+    -------
+    list of lists
+        list of two-member lists containing each pairwise comparison.
     """
 
-    try:
-        return math.factorial(x) // math.factorial(y) // math.factorial(x - y)
-    except ValueError:
-        return 0
+    if isinstance(data, pd.DataFrame):
+        data = data.to_numpy()
+    comparisons = []
+    for i, j in combinations(np.unique(data[:, treatment_col]), 2):
+        comparisons.append([i, j])
+    comparisons = np.array(comparisons, dtype="object")
+    out = np.empty((comparisons.shape[0], comparisons.shape[1] + 1), dtype="object")
+    out[:, :-1] = comparisons
+    return out
 
 
 def _false_discovery_adjust(pvals, return_index=False):
@@ -867,6 +2157,9 @@ def confidence_interval(
     permutations=100,
     kind="bayesian",
     random_state=None,
+    method="secant",
+    n_jobs=None,
+    return_evaluations=False,
 ):
     """Compute a confidence inverval via test inversion.
 
@@ -901,19 +2194,49 @@ def confidence_interval(
     bootstraps : int, optional
         Number of bootstraps to perform, by default 100. Can be set to 1 for a
         permutation test without any bootstrapping.
-    permutations : int or "all", optional
+    permutations : int, "all" or "auto", optional
         Number of permutations to perform PER bootstrap sample. "all"
-        for exact test (only works if there are only two treatments), by default 1000
+        for exact test, which enumerates permutations within clusters if
+        treatment_col is not 0. "auto" enumerates every permutation if there
+        are no more than 1000 and performs 1000 random permutations otherwise,
+        by default 1000
     kind : str, optional
         Bootstrap algorithm - see Bootstrapper class, by default "bayesian"
     random_state : int or numpy random Generator, optional
         Seedable for reproducibility., by default None
+    method : {"manly", "secant"} or function, optional
+        Strategy for refining each bound, by default "secant". "manly" moves
+        the bound to the quantile of the null distribution at the current
+        bound. "secant" takes growing steps in the same direction until the
+        target p-value is bracketed, then interpolates between the bracketing
+        bounds, so it does not creep across flat stretches of the p-value.
+        A custom search takes the same arguments as the functions in
+        BOUND_SEARCHES and returns the bound and its p-value.
+    n_jobs : int, optional
+        If -1 or greater than 1, the lower and upper bounds are searched for
+        concurrently on two threads, by default None
+    return_evaluations : bool, optional
+        Also return the number of null distributions evaluated while refining
+        each bound, by default False
 
     Returns
     -------
     tuple of floats
         Confidence interval spanning the specified interval.
 
+    tuple of ints
+        Number of null distributions evaluated for the lower and upper bound.
+        Only returned if return_evaluations is True.
+
+    Raises
+    ------
+    TypeError
+        Raised if input data is not ndarray or DataFrame.
+    KeyError
+        If method is a string, it must be in the BOUND_SEARCHES dictionary.
+    AttributeError
+        If method is a custom search, it must be a function.
+
     Notes
     -----
     While the Efron bootstrap is the default in most of hierarch's statistical functions,
@@ -924,6 +2247,12 @@ def confidence_interval(
     "Randomization, Bootstrap and Monte Carlo Methods in Biology" by Bryan FJ Manly.
     https://doi.org/10.1201/9781315273075.
 
+    The resamples are only drawn once. Shifting the dependent variable by a
+    multiple of the treatment column shifts every aggregated resample by the
+    same multiple of the aggregated treatment column, so each candidate bound
+    is tested against the same resamples without any Monte Carlo jitter
+    between iterations. They are all held in memory at once.
+
     Examples
     --------
     Specify the parameters of a dataset with a difference of means of 2.
@@ -979,14 +2308,12 @@ def confidence_interval(
     >>> confidence_interval(data, treatment_col=0, interval=95,
     ...                 compare='corr', bootstraps=100,
     ...                 permutations=1000, random_state=1)
-    (0.8317584051133191, 1.6192897830814992)
+    (0.8317584051133191, 1.6264758582729206)
 
     The dataset was specified to have a true slope of 1, which is within the interval.
 
     """
 
-    rng = np.random.default_rng(random_state)
-
     alpha = (100 - interval) / 200
 
     # turns the input array or dataframe into a float64 array
@@ -997,121 +2324,503 @@ def confidence_interval(
     else:
         raise TypeError("Input data must be ndarray or DataFrame.")
 
-    # first compute the null distribution against the null that the effect size is equal to the MLE
+    if n_jobs is not None:
+        if not isinstance(n_jobs, int) or (n_jobs < 1 and n_jobs != -1):
+            raise TypeError("n_jobs must be -1 or an integer greater than 0")
+
+    # every bound below is tested against the same resamples, shifted by the
+    # candidate bound, so they are only drawn once
+    start_slope, resamples = _null_imposed_resamples(
+        data, treatment_col, skip, bootstraps, permutations, kind, random_state
+    )
+
+    # compute the null distribution for the null hypothesis that the true effect
+    # size is equal to the MLE and make a guess as to the lower and upper
+    # bounds of the confidence interval
+    treatment_labels = tuple(resamples[0][:, treatment_col].tolist())
+    null_agg, _, null = _shifted_null(
+        resamples, _batch_stat_factory(treatment_labels, "corr"), treatment_col, 0.0
+    )
+
+    current_lower = _compute_interval(null, null_agg, treatment_col, alpha)
+    current_upper = _compute_interval(null, null_agg, treatment_col, 1 - alpha)
+
+    # refine the bounds via iterative hypothesis testing
+    # each bound needs to be found separately
+
+    if isinstance(compare, str):
+        batch_stat = _batch_stat_factory(treatment_labels, compare)
+    elif callable(compare):
+
+        def batch_stat(X, y):
+            return np.array([compare(x, y) for x in X])
+
+    else:
+        raise AttributeError("Custom test statistics must be callable.")
+
+    if isinstance(method, str):
+        try:
+            search = BOUND_SEARCHES[method]
+        except KeyError:
+            raise KeyError("No such bound search.")
+    elif callable(method):
+        search = method
+    else:
+        raise AttributeError("Custom bound searches must be callable.")
+
+    if compare == "means":
+        alternative_lower, alternative_upper = "greater", "less"
+    else:
+        alternative_lower, alternative_upper = "less", "greater"
+
+    def _find_bound(start, alternative, quantile):
+        evaluations = 0
+
+        def evaluate(bound):
+            nonlocal evaluations
+            evaluations += 1
+            bound_agg, truediff, null = _shifted_null(
+                resamples, batch_stat, treatment_col, bound
+            )
+            return (
+                _p_value(truediff, null, alternative),
+                _compute_interval(null, bound_agg, treatment_col, quantile),
+            )
+
+        bound, p = search(evaluate, start, alpha, tolerance, iterations)
+        return bound, p, evaluations
+
+    searches = (
+        (current_lower, alternative_lower, alpha),
+        (current_upper, alternative_upper, 1 - alpha),
+    )
+    if n_jobs is None or n_jobs == 1:
+        results = [_find_bound(*args) for args in searches]
+    else:
+        # the test statistics release the GIL, so the two searches can
+        # run on separate cores
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(lambda args: _find_bound(*args), searches))
+
+    for tail, (_, current_p, _) in zip(("lower tail:", "upper tail:"), results):
+        if np.abs(100 * (alpha - current_p)) >= tolerance:
+            warn(
+                " ".join([tail, str(current_p), "failed to converge"]),
+                ConvergenceWarning,
+                stacklevel=2,
+            )
+
+    (current_lower, _, lower_evals), (current_upper, _, upper_evals) = results
+    interval = current_lower + start_slope, current_upper + start_slope
+
+    if return_evaluations:
+        return interval, (lower_evals, upper_evals)
+    return interval
+
+
+def _manly_search(evaluate, start, alpha, tolerance, iterations):
+    """Refines a bound by moving it to the quantile of the null distribution
+    computed at the current bound.
+
+    Parameters
+    ----------
+    evaluate : function
+        Takes a bound and returns its p-value and the bound suggested by
+        the null distribution at that bound.
+    start : float
+        Initial guess.
+    alpha : float
+        Target p-value.
+    tolerance : float
+        Stop once the p-value is within this many percentage points of alpha.
+    iterations : int
+        Maximum number of calls to evaluate.
+
+    Returns
+    -------
+    bound : float
+    p : float
+        p-value of the last bound that was evaluated.
+    """
+    bound = start
+    for i in range(iterations):
+        p, guess = evaluate(bound)
+        if np.abs(100 * (alpha - p)) < tolerance:
+            break
+        bound = guess
+    return bound, p
+
+
+def _secant_search(evaluate, start, alpha, tolerance, iterations):
+    """Finds a bound by bracketing alpha with growing Manly steps, then
+    narrowing the bracket by regula falsi.
+
+    The p-value is a step function of the bound, so the bracket is kept and
+    bisected whenever interpolation stalls next to a jump.
+    Takes and returns the same arguments as _manly_search.
+    """
+    bound = start
+    p, guess = evaluate(bound)
+    best = bound, p
+    if np.abs(100 * (alpha - p)) < tolerance:
+        return best
+    # (bound, p - alpha) at the last point on either side of alpha
+    sides = {p > alpha: (bound, p - alpha)}
+    replaced = None
+    bisect = False
+    step = 0.0
+
+    for i in range(iterations - 1):
+        if len(sides) < 2:
+            # step the way the null distribution suggests until alpha is
+            # bracketed, at least doubling the last step in that direction so
+            # that flat stretches of the p-value are crossed quickly
+            suggested = guess - bound
+            if suggested * step >= 0 and np.abs(suggested) < 2 * np.abs(step):
+                suggested = 2 * step
+            step = suggested if suggested != 0 else 1.0
+            bound = bound + step
+        else:
+            (a, f_a), (b, f_b) = sides[False], sides[True]
+            if bisect:
+                bound = (a + b) / 2
+            else:
+                bound = b - f_b * (b - a) / (f_b - f_a)
+
+        p, guess = evaluate(bound)
+        if np.abs(alpha - p) < np.abs(alpha - best[1]):
+            best = bound, p
+        if np.abs(100 * (alpha - p)) < tolerance:
+            break
+
+        side = p > alpha
+        # interpolating stalls next to a jump in the p-value, which shows up
+        # as the same endpoint being replaced twice. bisect once if it does
+        bisect = len(sides) == 2 and side == replaced and not bisect
+        replaced = side if len(sides) == 2 else None
+        sides[side] = bound, p - alpha
+
+    return best
+
+
+#: ("manly", "secant") Bound searches that can be given to confidence_interval.
+BOUND_SEARCHES = {"manly": _manly_search, "secant": _secant_search}
+
+
+def _null_imposed_resamples(
+    data, treatment_col, skip, bootstraps, permutations, kind, random_state
+):
+    """Draws shiftable resamples of data after subtracting out the observed
+    slope, so that they are resamples under the null hypothesis that the
+    true effect size is equal to the MLE.
+
+    Returns
+    -------
+    start_slope : float
+        Observed slope of the dependent variable on the treatment column.
+    resamples : tuple
+        Output of _shift_resamples.
+    """
     null_imposed_data = data.copy()
     levels_to_agg = data.shape[1] - treatment_col - 3
 
+    # every resample below is on the same design, so only identify it once
+    hierarchy = Hierarchy(data)
+
     grouper = GroupbyMean()
-    grouper.fit(data)
+    grouper.fit(data, hierarchy=hierarchy)
     test = grouper.transform(data, iterations=levels_to_agg)
-    start_slope = bivar_central_moment(
-        test[:, treatment_col], test[:, -1]
-    ) / bivar_central_moment(test[:, treatment_col], test[:, treatment_col])
+    sum_xy, _, sum_xx, _ = bivar_central_sums(test[:, treatment_col], test[:, -1])
+    n = len(test)
+    start_slope = (sum_xy / (n - 1)) / (sum_xx / (n - 1))
 
     # subtract the observed covariance out
     correction = start_slope * null_imposed_data[:, treatment_col]
     null_imposed_data[:, -1] -= correction
 
-    # compute the null distribution for the null hypothesis that the true effect
-    # size is equal to the MLE
-    _, null = hypothesis_test(
+    resamples = _shift_resamples(
         null_imposed_data,
         treatment_col,
-        skip=skip,
-        bootstraps=bootstraps,
-        permutations=permutations,
-        kind=kind,
-        return_null=True,
-        random_state=rng,
+        skip,
+        bootstraps,
+        permutations,
+        kind,
+        random_state,
+        hierarchy,
     )
+    return start_slope, resamples
+
 
-    # make a guess as to the lower and upper bounds of the confidence interval
+def _shift_resamples(
+    data, treatment_col, skip, bootstraps, permutations, kind, random_state, hierarchy
+):
+    """Draws the resamples of a hypothesis test in a form that can be reused
+    for any shift of the dependent variable by a multiple of the treatment
+    column.
+
+    Aggregation is linear in the dependent variable, so if y is shifted by
+    c * x, every aggregated resample of y shifts by c times the same
+    resample of x. Storing both lets the null distribution for any c be
+    computed without drawing new resamples.
 
-    null_agg = grouper.transform(null_imposed_data, iterations=levels_to_agg)
+    Parameters
+    ----------
+    data : 2D array
+        Preprocessed data.
+    treatment_col : int
+    skip : list of ints or None
+    bootstraps : int
+    permutations : int, "all" or "auto"
+    kind : str
+        Bootstrap algorithm - see Bootstrapper class.
+    random_state : int or numpy random Generator
+    hierarchy : Hierarchy
+        Hierarchy of data.
 
-    current_lower = _compute_interval(np.array(null), null_agg, treatment_col, alpha)
-    current_upper = _compute_interval(
-        np.array(null), null_agg, treatment_col, 1 - alpha
+    Returns
+    -------
+    test : 2D array
+        Data aggregated up to the treated level.
+    labels : list of 2D arrays
+        Permutations of the treatment column of each bootstrapped sample.
+    y_parts, x_parts : lists of 1D arrays
+        Aggregated dependent variable of each bootstrapped sample, and the
+        same aggregate with the dependent variable replaced by the treatment
+        column.
+    """
+    fitted = _fit_resamplers(
+        data,
+        treatment_col,
+        skip,
+        bootstraps,
+        permutations,
+        kind,
+        random_state,
+        hierarchy,
+    )
+    data, hierarchy, bootstrapper, aggregator, levels_to_agg, bootstraps, test = fitted
+    permuter, permutations = _fit_permuter(
+        test, treatment_col, permutations, hierarchy.collapse(levels_to_agg)
     )
 
-    # refine the bounds via iterative hypothesis testing
-    # each bound needs to be found separately
+    x_data = data.copy()
+    x_data[:, -1] = data[:, treatment_col]
 
-    # find lower bound
+    labels, y_parts, x_parts = [], [], []
+    for j in range(bootstraps):
+        # bootstrap 0 is always the original data
+        if j == 0:
+            y_sample = test
+            x_sample = aggregator.transform(x_data, iterations=levels_to_agg)
+        else:
+            weights = bootstrapper.weights(start=treatment_col + 2)
+            y_sample = _aggregate_resample(
+                aggregator, data, weights, levels_to_agg, kind
+            )
+            x_sample = _aggregate_resample(
+                aggregator, x_data, weights, levels_to_agg, kind
+            )
+        labels.append(permuter.transform_batch(y_sample, permutations))
+        y_parts.append(y_sample[:, -1])
+        x_parts.append(x_sample[:, -1])
 
-    if compare == "means":
-        alternative_lower, alternative_upper = "greater", "less"
-    else:
-        alternative_lower, alternative_upper = "less", "greater"
+    return test, labels, y_parts, x_parts
 
-    for i in range(iterations):
-        bound_imposed_data = null_imposed_data.copy()
-        bound_imposed_data[:, -1] += (current_lower) * bound_imposed_data[
-            :, treatment_col
-        ]
-        current_p, null = hypothesis_test(
-            bound_imposed_data,
-            treatment_col,
-            compare=compare,
-            alternative=alternative_lower,
-            skip=skip,
-            bootstraps=bootstraps,
-            permutations=permutations,
-            kind=kind,
-            return_null=True,
-            random_state=rng,
+
+def _aggregate_resample(aggregator, data, weights, levels_to_agg, kind):
+    """Aggregates a bootstrapped sample of data, given its bootstrap weights,
+    levels_to_agg levels up with a fitted GroupbyMean.
+    """
+    if kind == "indexes":
+        # resampled rows are grouped using the weights that repeated them
+        return aggregator.transform(
+            data[weights_to_index(weights)],
+            iterations=levels_to_agg,
+            weights=weights,
         )
+    sample = data.copy()
+    sample[:, -1] *= weights
+    return aggregator.transform(sample, iterations=levels_to_agg)
 
-        if np.abs(100 * (alpha - current_p)) < tolerance:
-            break
 
-        bound_agg = grouper.transform(bound_imposed_data, iterations=levels_to_agg)
+def _shifted_null(resamples, batch_stat, treatment_col, shift):
+    """Evaluates a batched test statistic on resamples from _shift_resamples
+    after shifting the dependent variable by shift times the treatment column.
+
+    Returns
+    -------
+    shifted : 2D array
+        Shifted data aggregated up to the treated level.
+    truediff : float
+        Observed test statistic.
+    null_distribution : 1D array
+    """
+    test, labels, y_parts, x_parts = resamples
+
+    shifted = test.copy()
+    shifted[:, -1] = y_parts[0] + shift * x_parts[0]
+    truediff = batch_stat(shifted[:, treatment_col].reshape((1, -1)), shifted[:, -1])[0]
+
+    null_distribution = np.concatenate(
+        [batch_stat(X, y + shift * x) for X, y, x in zip(labels, y_parts, x_parts)]
+    )
+    return shifted, truediff, null_distribution
 
-        current_lower = _compute_interval(
-            np.array(null), bound_agg, treatment_col, alpha
-        )
 
+def confidence_curve(
+    data_array,
+    treatment_col,
+    shifts=101,
+    compare="corr",
+    skip=None,
+    bootstraps=50,
+    permutations=100,
+    kind="bayesian",
+    random_state=None,
+):
+    """Compute the p-value function of the effect size.
+
+    The p-value at each effect size is that of the two-sided hypothesis test
+    that the true slope is equal to it. Every effect size is tested against
+    the same resamples, so the confidence interval at any level can be read
+    off of the curve as the range of effect sizes with a p-value above
+    1 - interval / 100.
+
+    Parameters
+    ----------
+    data_array : 2D numpy array or pandas DataFrame
+        Array-like containing both the independent and dependent variables to
+        be analyzed. It's assumed that the final (rightmost) column
+        contains the dependent variable values.
+    treatment_col : int or str
+        The index number of the column containing "two samples" to be compared.
+        Indexing starts at 0. If input data is a pandas DataFrame, this can be
+        the column name.
+    shifts : int or 1D array, optional
+        Effect sizes to test, or the number of evenly spaced effect sizes to
+        test around the observed effect size, by default 101. A number of
+        effect sizes spans about one and a half times the 99.9% interval.
+    compare : str, optional
+        The test statistic to use to perform the hypothesis test, by default "corr"
+        which automatically calls the studentized covariance test statistic.
+    skip : list of ints, optional
+        Columns to skip in the bootstrap. Skip columns that were sampled
+        without replacement from the prior column, by default None
+    bootstraps : int, optional
+        Number of bootstraps to perform, by default 50. Can be set to 1 for a
+        permutation test without any bootstrapping.
+    permutations : int, "all" or "auto", optional
+        Number of permutations to perform PER bootstrap sample. "all"
+        for exact test, which enumerates permutations within clusters if
+        treatment_col is not 0. "auto" enumerates every permutation if there
+        are no more than 1000 and performs 1000 random permutations otherwise,
+        by default 100
+    kind : str, optional
+        Bootstrap algorithm - see Bootstrapper class, by default "bayesian"
+    random_state : int or numpy random Generator, optional
+        Seedable for reproducibility., by default None
+
+    Returns
+    -------
+    1D array
+        Effect sizes that were tested.
+    1D array
+        p-value at each effect size.
+
+    Raises
+    ------
+    TypeError
+        Raised if input data is not ndarray or DataFrame, or if shifts is
+        neither an integer greater than 1 nor a 1D array.
+    AttributeError
+        If comparison is a custom statistic, it must be a function.
+
+    Examples
+    --------
+    Specify the parameters of a dataset with a difference of means of 2.
+
+    >>> from hierarch.power import DataSimulator
+    >>> import scipy.stats as stats
+    >>> paramlist = [[0, 2], [stats.norm], [stats.norm]]
+    >>> hierarchy = [2, 4, 3]
+    >>> datagen = DataSimulator(paramlist, random_state=2)
+    >>> datagen.fit(hierarchy)
+    >>> data = datagen.generate()
+
+    >>> shifts, pvals = confidence_curve(data, treatment_col=0, bootstraps=1000,
+    ...                                  permutations='all', random_state=1)
+
+    The p-value is largest around the observed effect size and falls off in
+    either direction.
+
+    >>> shifts[pvals.argmax()]
+    3.719732876395903
+
+    Intervals at several levels can be read off of the same curve.
+
+    >>> for interval in (80, 90, 95):
+    ...     accepted = shifts[pvals > 1 - interval / 100]
+    ...     print(interval, accepted.min().round(2), accepted.max().round(2))
+    80 2.37 5.07
+    90 1.96 5.47
+    95 1.42 6.01
+
+    The 95% interval agrees with the one found by confidence_interval to
+    within the spacing of the grid. An interval can only be read off if the
+    smallest p-value on the curve is below its level.
+
+    """
+    # turns the input array or dataframe into a float64 array
+    if isinstance(data_array, (np.ndarray, pd.DataFrame)):
+        if isinstance(data_array, pd.DataFrame) and isinstance(treatment_col, str):
+            treatment_col = int(data_array.columns.get_loc(treatment_col))
+        data = _preprocess_data(data_array)
     else:
-        warn(
-            " ".join(["lower tail:", str(current_p), "failed to converge"]),
-            ConvergenceWarning,
-            stacklevel=2,
-        )
+        raise TypeError("Input data must be ndarray or DataFrame.")
 
-    for i in range(iterations):
-        bound_imposed_data = null_imposed_data.copy()
-        bound_imposed_data[:, -1] += (current_upper) * bound_imposed_data[
-            :, treatment_col
-        ]
-        current_p, null = hypothesis_test(
-            bound_imposed_data,
-            treatment_col,
-            compare=compare,
-            alternative=alternative_upper,
-            skip=skip,
-            bootstraps=bootstraps,
-            permutations=permutations,
-            kind=kind,
-            return_null=True,
-            random_state=rng,
-        )
+    if isinstance(shifts, (int, np.integer)) and not isinstance(shifts, bool):
+        if shifts < 2:
+            raise TypeError("shifts must be an integer greater than 1 or a 1D array.")
+    else:
+        shifts = np.asarray(shifts, dtype=np.float64)
+        if shifts.ndim != 1:
+            raise TypeError("shifts must be an integer greater than 1 or a 1D array.")
 
-        if np.abs(100 * (alpha - current_p)) < tolerance:
-            break
-        bound_agg = grouper.transform(bound_imposed_data, iterations=levels_to_agg)
+    start_slope, resamples = _null_imposed_resamples(
+        data, treatment_col, skip, bootstraps, permutations, kind, random_state
+    )
+    treatment_labels = tuple(resamples[0][:, treatment_col].tolist())
 
-        current_upper = _compute_interval(
-            np.array(null), bound_agg, treatment_col, 1 - alpha
-        )
+    if isinstance(compare, str):
+        batch_stat = _batch_stat_factory(treatment_labels, compare)
+    elif callable(compare):
+
+        def batch_stat(X, y):
+            return np.array([compare(x, y) for x in X])
 
     else:
-        warn(
-            " ".join(["upper tail:", str(current_p), "failed to converge"]),
-            ConvergenceWarning,
-            stacklevel=2,
+        raise AttributeError("Custom test statistics must be callable.")
+
+    if not isinstance(shifts, np.ndarray):
+        # the null distribution at the observed effect size gives the width
+        # of the grid
+        corr_stat = _batch_stat_factory(treatment_labels, "corr")
+        null_agg, _, null = _shifted_null(resamples, corr_stat, treatment_col, 0.0)
+        half_width = 1.5 * max(
+            np.abs(_compute_interval(null, null_agg, treatment_col, quantile))
+            for quantile in (0.0005, 0.9995)
         )
+        shifts = np.linspace(start_slope - half_width, start_slope + half_width, shifts)
 
-    return current_lower + start_slope, current_upper + start_slope
+    pvals = np.empty(shifts.size)
+    for i, shift in enumerate(shifts):
+        # testing an effect size means subtracting it out of the data
+        _, truediff, null = _shifted_null(
+            resamples, batch_stat, treatment_col, start_slope - shift
+        )
+        pvals[i] = _p_value(truediff, null, "two-sided")
+
+    return shifts, pvals
 
 
 class ConvergenceWarning(Warning):
@@ -1127,7 +2836,7 @@ class ConvergenceWarning(Warning):
         return repr(self.message)
 
 
-@jit(nopython=True, cache=True)
+@jit(nopython=True, cache=True, nogil=True)
 def _compute_interval(null, null_data, treatment_col, quantile):
     """Unpivots a test statistic to a slope.
 
@@ -1165,9 +2874,12 @@ def _compute_interval(null, null_data, treatment_col, quantile):
     """
     x = null_data[:, treatment_col]
     y = null_data[:, -1]
+    n = len(x)
 
-    denom = _cov_std_error(x, y)
-    bound = np.quantile(null, quantile) * denom / bivar_central_moment(x, x)
+    # the standard error and the variance of x come from the same pass
+    sum_xy, sum_x2y2, sum_xx, sum_yy = bivar_central_sums(x, y)
+    denom = _std_error_from_sums(n, sum_xy, sum_x2y2, sum_xx, sum_yy)
+    bound = np.quantile(null, quantile) * denom / (sum_xx / (n - 1))
 
     return bound
 
@@ -1206,20 +2918,36 @@ def _cov_std_error(x, y):
 
     """
     n = len(x)
+    return _std_error_from_sums(n, *bivar_central_sums(x, y))
+
+
+@jit(nopython=True, cache=True)
+def _std_error_from_sums(n, sum_xy, sum_x2y2, sum_xx, sum_yy):
+    """Computes the standard error of the covariance from the output of
+    bivar_central_sums.
+
+    Parameters
+    ----------
+    n : int
+        Number of observations.
+    sum_xy, sum_x2y2, sum_xx, sum_yy : float
+        Central sums from bivar_central_sums.
+
+    Returns
+    -------
+    float
+    """
     # first term is the second symmetric bivariate central moment. an approximate
     # bias correction of n - root(2) is applied
-    denom_1 = bivar_central_moment(x, y, pow=2, ddof=2**0.5)
+    denom_1 = sum_x2y2 / (n - 2**0.5)
 
     # second term is the product of the standard deviations of x and y over n - 1.
     # this term rapidly goes to 0 as n goes to infinity
-    denom_2 = (
-        bivar_central_moment(x, x, pow=1, ddof=1)
-        * bivar_central_moment(y, y, pow=1, ddof=1)
-    ) / (n - 1)
+    denom_2 = ((sum_xx / (n - 1)) * (sum_yy / (n - 1))) / (n - 1)
 
     # third term is the square of the covariance of x and y. an approximate bias
     # correction of n - root(3) is applied
-    denom_3 = ((n - 2) * (bivar_central_moment(x, y, pow=1, ddof=1.75) ** 2)) / (n - 1)
+    denom_3 = ((n - 2) * ((sum_xy / (n - 1.75)) ** 2)) / (n - 1)
     return ((1 / (n - 1.5)) * (denom_1 + denom_2 - denom_3)) ** 0.5
 
 
@@ -1230,7 +2958,8 @@ def hierarchical_randomization(
     bootstraps: int = 100,
     permutations: int = 1000,
     random_state: Optional[Union[int, np.random.Generator]] = None,
-) -> Generator[np.ndarray, None, None]:
+    output: str = "data",
+) -> Generator[Union[np.ndarray, Tuple[np.ndarray, np.ndarray]], None, None]:
     """Yields permuted datasets for a hierarchical randomization test.
 
     Parameters
@@ -1249,16 +2978,27 @@ def hierarchical_randomization(
     bootstraps : int, optional
         Number of bootstraps to perform, by default 100. Can be set to 1 for a
         permutation test without any bootstrapping.
-    permutations : int, optional
+    permutations : int, "all" or "auto", optional
         Number of permutations to perform PER bootstrap sample. "all"
-        for exact test (only works if there are only two treatments), by default 1000
+        for exact test, which enumerates permutations within clusters if
+        treatment_col is not 0. "auto" enumerates every permutation if there
+        are no more than 1000 and performs 1000 random permutations otherwise,
+        by default 1000
     random_state : int or numpy random Generator, optional
         Seedable for reproducibility., by default None
+    output : str, optional
+        "data" yields each bootstrapped sample with its treatment column
+        permuted in place. "buffer" does the same, but every bootstrapped
+        sample is written to one reusable array. "column" yields the
+        bootstrapped sample with its original treatment column alongside the
+        permuted treatment column, both in reusable arrays. By default "data"
 
     Yields
     ------
-    Generator[np.ndarray, None, None]
-        Permuted data for a hierarchical randomization test.
+    Generator[np.ndarray or (np.ndarray, np.ndarray), None, None]
+        Permuted data for a hierarchical randomization test. Yielded arrays
+        are overwritten by later permutations, and, unless output is "data",
+        by later bootstraps, so copy them to keep them.
 
     """
     # turns the input array or dataframe into a float64 array
@@ -1274,49 +3014,81 @@ def hierarchical_randomization(
     # set random state
     rng = np.random.default_rng(random_state)
 
-    # enforce lower bound on skip
-    if skip is not None:
-        skip = list(skip)
-        for v in reversed(skip):
-            if v <= treatment_col + 1:
-                warn("No need to include columns before treated columns in skip.")
-                skip.remove(v)
-    else:
-        skip = []
+    # yielded samples keep every row, so skipped lowest levels are left as
+    # they are rather than averaged over as in hypothesis_test
+    skip = _check_skip(treatment_col, skip)
+    _check_resamples(bootstraps, permutations)
 
-    # enforce bounds on bootstraps and permutations
-    if not isinstance(bootstraps, int) or bootstraps < 1:
-        raise TypeError("bootstraps must be an integer greater than 0")
-    if isinstance(permutations, str):
-        if permutations != "all":
-            raise TypeError("permutations must be 'all' or an integer greater than 0")
-    elif not isinstance(permutations, int) or permutations < 1:
-        raise TypeError("permutations must be 'all' or an integer greater than 0")
+    if output not in ("data", "buffer", "column"):
+        raise KeyError("Invalid 'output' argument.")
+
+    # identify the clusters once and share them between every fit
+    hierarchy = Hierarchy(data)
 
     # initialize and fit the bootstrapper to the data
     bootstrapper = Bootstrapper(random_state=rng, kind="indexes")
-    bootstrapper.fit(data, skip=skip)
+    bootstrapper.fit(data, skip=skip, hierarchy=hierarchy)
 
-    for i in range(bootstraps):
-        # get a bootstrap sample
-        bootstrapped_sample = bootstrapper.transform(data, start=treatment_col + 2)
+    # bootstraps only resample below the permuted units, the clusters of the
+    # column after the treated column. so, the permuter is fit once to one row
+    # per unit and every permutation is expanded to the bootstrapped sample.
+    # don't need to seed this, as numba's PRNG state is shared
+    units = hierarchy.uniques[treatment_col + 2].astype(np.float64)
+    unit_starts = hierarchy.offsets[treatment_col + 2][:-1]
+    permuter = Permuter()
+
+    if permutations == "all":
+        permuter.fit(units, treatment_col, exact=True)
+
+    elif permutations == "auto":
+        # only enumerate the permutations if there are few of them
+        permuter.fit(units, treatment_col, exact="auto", budget=1000)
+
+    else:
+        # just fit the permuter if this is a randomized test
+        permuter.fit(units, treatment_col)
 
-        # initialize and fit the permuter to the aggregated data
-        # don't need to seed this, as numba's PRNG state is shared
-        permuter = Permuter()
+    if permuter.exact:
+        # in the exact case, determine and set the total number of
+        # possible permutations
+        n_permutations = permuter.n_permutations
+    elif permutations == "auto":
+        n_permutations = 1000
+    else:
+        n_permutations = permutations
 
-        if permutations == "all":
-            permuter.fit(bootstrapped_sample, treatment_col, exact=True)
+    buffer = np.empty((0, data.shape[1]))
+    column = np.empty(0)
 
-            # in the exact case, determine and set the total number of
-            # possible permutations
-            counts = np.unique(bootstrapped_sample[:, 0], return_counts=True)[1]
-            permutations = _binomial(counts.sum(), counts[0])
+    for i in range(bootstraps):
+        # get a bootstrap sample
+        weights = bootstrapper.weights(start=treatment_col + 2)
+        indexes = weights_to_index(weights)
 
+        if output == "data":
+            bootstrapped_sample = data[indexes]
+        else:
+            if indexes.size > buffer.shape[0]:
+                buffer = np.empty((indexes.size, data.shape[1]))
+                column = np.empty(indexes.size)
+            bootstrapped_sample = buffer[: indexes.size]
+            np.take(data, indexes, axis=0, out=bootstrapped_sample)
+
+        if output == "column":
+            permuted = column[: indexes.size]
         else:
-            # just fit the permuter if this is a randomized test
-            permuter.fit(bootstrapped_sample, treatment_col)
+            permuted = bootstrapped_sample[:, treatment_col]
+
+        # the unit that each row of the bootstrapped sample belongs to
+        unit_index = np.arange(units.shape[0]).repeat(
+            np.add.reduceat(weights, unit_starts)
+        )
 
-        for j in range(permutations):
+        for j in range(n_permutations):
             # yield a permuted sample
-            yield permuter.transform(bootstrapped_sample)
+            permuter.transform(units)
+            np.take(units[:, treatment_col], unit_index, out=permuted)
+            if output == "column":
+                yield bootstrapped_sample, permuted
+            else:
+                yield bootstrapped_sample
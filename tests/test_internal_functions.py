@@ -1,3 +1,4 @@
+import itertools
 import unittest
 from hierarch import internal_functions
 from hierarch.power import DataSimulator
@@ -72,6 +73,18 @@ class TestNumbaUnique(unittest.TestCase):
                 ret = internal_functions.nb_unique(data[:, :treatment_col])
                 self._check_unique(data, treatment_col, ret)
 
+    def test_nb_unique_unsorted(self):
+        """
+        Check nb_unique on input that is not lexicographically sorted, with
+        both integer and non-integer labels.
+        """
+        rng = np.random.default_rng(1)
+        for scale in (1, 0.5, 1e9):
+            data = rng.integers(4, size=(100, 3)) * scale
+            for col in range(1, data.shape[1] + 1):
+                ret = internal_functions.nb_unique(data[:, :col])
+                self._check_unique(data, col, ret)
+
 
 class TestBivarCentralMoment(unittest.TestCase):
     def test_var(self):
@@ -98,6 +111,26 @@ class TestBivarCentralMoment(unittest.TestCase):
             ret = internal_functions.bivar_central_moment(x, y, pow=1, ddof=ddof)
             self.assertAlmostEqual(ret, np.cov(x, y, ddof=ddof)[0, 1])
 
+    def test_sums(self):
+        """
+        Check that bivar_central_sums gives the same moments as bivar_central_moment
+        """
+        rng = np.random.default_rng(789)
+        x = rng.random(size=10)
+        y = rng.random(size=10)
+        sum_xy, sum_x2y2, sum_xx, sum_yy = internal_functions.bivar_central_sums(x, y)
+        for ddof in (1, 2**0.5, 1.75):
+            self.assertEqual(
+                sum_xy / (10 - ddof),
+                internal_functions.bivar_central_moment(x, y, pow=1, ddof=ddof),
+            )
+            self.assertEqual(
+                sum_x2y2 / (10 - ddof),
+                internal_functions.bivar_central_moment(x, y, pow=2, ddof=ddof),
+            )
+        self.assertEqual(sum_xx / 9, internal_functions.bivar_central_moment(x, x))
+        self.assertEqual(sum_yy / 9, internal_functions.bivar_central_moment(y, y))
+
 
 class TestBoundedUInt(unittest.TestCase):
     def _check_bound(self, ub, ret):
@@ -167,6 +200,71 @@ class TestIDClusters(unittest.TestCase):
                         self.assertEqual(hierarchy[idx][idx_2], v)
 
 
+class TestHierarchy(unittest.TestCase):
+    def test_hierarchy(self):
+        """
+        Checks that Hierarchy matches id_cluster_counts and nb_unique, including
+        when some rows are repeated.
+        """
+        hierarchies = ([2, 3, 3], [2, [4, 3], 3], [2, 3, [10, 11, 5, 6, 4, 3]])
+        parameters = [[stats.norm, 0, 0], [stats.norm, 0, 0], [stats.norm, 0, 0]]
+        sim = DataSimulator(parameters)
+
+        for hierarchy in hierarchies:
+            sim.fit(hierarchy)
+            data = sim.generate()
+            repeated = data.repeat(np.arange(len(data)) % 3 + 1, axis=0)
+            for target in (data, repeated):
+                ret = internal_functions.Hierarchy(target)
+                counts = internal_functions.id_cluster_counts(target[:, :-1])
+                for idx, level in enumerate(reversed(list(counts.values()))):
+                    np.testing.assert_array_equal(level, ret.cluster_counts[idx])
+
+                for col in range(1, target.shape[1]):
+                    unique, index = internal_functions.nb_unique(target[:, :col])[:2]
+                    np.testing.assert_array_equal(unique, ret.uniques[col])
+                    np.testing.assert_array_equal(index, ret.offsets[col][:-1])
+
+            # collapsing a level matches the hierarchy of the aggregated data
+            aggregated = internal_functions.GroupbyMean().fit_transform(data)
+            collapsed = internal_functions.Hierarchy(data).collapse(1)
+            for idx, level in enumerate(
+                internal_functions.Hierarchy(aggregated).cluster_counts
+            ):
+                np.testing.assert_array_equal(level, collapsed.cluster_counts[idx])
+
+    def test_matches(self):
+        """
+        Checks that a Hierarchy only matches data with the same design.
+        """
+        sim = DataSimulator([[stats.norm, 0, 0], [stats.norm, 0, 0], [stats.norm]])
+        sim.fit([2, 3, 3])
+        data = sim.generate()
+        hierarchy = internal_functions.Hierarchy(data)
+        self.assertTrue(hierarchy.matches(data))
+
+        # only the final column may differ
+        other = data.copy()
+        other[:, -1] += 1
+        self.assertTrue(hierarchy.matches(other))
+
+        other[4, 1] += 1
+        self.assertFalse(hierarchy.matches(other))
+        self.assertFalse(hierarchy.matches(data[:-1]))
+        self.assertFalse(hierarchy.matches(data[:, 1:]))
+
+        aggregated = internal_functions.GroupbyMean().fit_transform(data)
+        self.assertTrue(hierarchy.collapse(1).matches(aggregated))
+        self.assertFalse(hierarchy.matches(aggregated))
+
+    def test_hierarchy_exceptions(self):
+        with self.assertRaises(ValueError) as raises:
+            internal_functions.Hierarchy(np.array([[2, 1], [1, 1]]))
+        self.assertIn(
+            "Hierarchy requires lexicographically sorted data.", str(raises.exception)
+        )
+
+
 class TestWeightstoIndex(unittest.TestCase):
     def test_weights_to_index(self):
         """
@@ -200,6 +298,31 @@ class TestMultisetPermutations(unittest.TestCase):
 
             self.assertEqual(expected_length, len(list(internal_functions.msp(set))))
 
+    def test_msp_fill(self):
+        """
+        Checks that filling arrays in chunks visits every distinct permutation
+        once and starts over in the same order once all have been visited.
+        """
+        items = np.array([1.0, 1.0, 2.0, 2.0, 3.0])
+        distinct = set(itertools.permutations(items))
+        stratification = np.array([0, items.size])
+        val, nxt, state = internal_functions.msp_state(items, stratification)
+
+        out = np.empty((7, items.size))
+        filled = []
+        laps = 0
+        for i in range(6):
+            laps += internal_functions.nb_msp_fill(val, nxt, state, stratification, out)
+            filled.append(out.copy())
+        filled = np.concatenate(filled)
+
+        self.assertEqual(laps, 1)
+        first_lap = filled[: len(distinct)]
+        self.assertEqual(set(map(tuple, first_lap)), distinct)
+        np.testing.assert_array_equal(
+            filled[len(distinct) :], first_lap[: len(filled) - len(distinct)]
+        )
+
 
 class TestGroupByMean(unittest.TestCase):
     def _compare_results(self, pd_agg, groupby_agg):
@@ -248,6 +371,103 @@ class TestGroupByMean(unittest.TestCase):
             ref_agg = grouper_2.transform(data)[:, -1]
             self._compare_results(ordinary_agg, ref_agg)
 
+    def test_groupby_mean_hierarchy(self):
+        """
+        Checks that fitting to a precomputed Hierarchy gives the same result.
+        """
+        sim = DataSimulator([[stats.norm], [stats.norm], [stats.norm]])
+        sim.fit([2, [4, 3], 3])
+        data = sim.generate()
+        grouper = internal_functions.GroupbyMean()
+        grouper.fit(data, hierarchy=internal_functions.Hierarchy(data))
+        self._compare_results(
+            internal_functions.GroupbyMean().fit_transform(data, iterations=2)[:, -1],
+            grouper.transform(data, iterations=2)[:, -1],
+        )
+
+    def test_weighted_groupby_mean(self):
+        """
+        Checks that aggregating weighted values matches aggregating a
+        reweighted copy of the data.
+        """
+        sim = DataSimulator([[stats.norm], [stats.norm], [stats.norm]])
+        sim.fit([2, [4, 3], 3])
+        data = sim.generate()
+        weights = np.random.default_rng(1).integers(0, 4, size=data.shape[0])
+        weighted = data.copy()
+        weighted[:, -1] *= weights
+        grouper = internal_functions.GroupbyMean()
+        grouper.fit(data)
+        for iterations in (0, 1, 2):
+            np.testing.assert_array_equal(
+                grouper.transform(weighted, iterations=iterations)[:, -1],
+                internal_functions.nb_weighted_groupby_mean(
+                    data[:, -1].copy(), weights, *grouper.fixed_offsets(iterations)
+                ),
+            )
+
+    def test_groupby_mean_resampled(self):
+        """
+        Checks that aggregating resampled rows using the weights that
+        repeated them matches matching the rows to the reference.
+        """
+        sim = DataSimulator([[stats.norm], [stats.norm], [stats.norm]])
+        sim.fit([2, [4, 3], 3])
+        data = sim.generate()
+        grouper = internal_functions.GroupbyMean()
+        grouper.fit(data)
+        weights = np.array([1, 1, 1, 0, 3, 0] + [0, 0, 3] * 2 + [2, 1, 0] * 3)
+        weights = np.concatenate(
+            (weights, np.ones(data.shape[0] - weights.size, dtype=np.int64))
+        )
+        target = data[internal_functions.weights_to_index(weights)]
+        for iterations in (1, 2):
+            np.testing.assert_array_equal(
+                grouper.transform(target, iterations=iterations),
+                grouper.transform(target, iterations=iterations, weights=weights),
+            )
+
+    def test_groupby_mean_cache(self):
+        """
+        Checks that the offsets cache counts hits and misses and evicts the
+        least recently used offsets.
+        """
+        data = np.array([[i // 4, i // 2, i, i] for i in range(8)], dtype=np.float64)
+        grouper = internal_functions.GroupbyMean(cache_size=2)
+        grouper.fit(data)
+        grouper.transform(data, iterations=2)
+        self.assertEqual((grouper.hits, grouper.misses), (0, 2))
+        grouper.transform(data, iterations=2)
+        self.assertEqual((grouper.hits, grouper.misses), (2, 2))
+
+        # duplicate the first cluster in place of the second, which evicts the
+        # first reduction's offsets
+        weights = np.array([2, 2, 0, 0, 1, 1, 1, 1])
+        target = data[internal_functions.weights_to_index(weights)]
+        grouper.transform(target, iterations=1, weights=weights)
+        self.assertEqual((grouper.hits, grouper.misses), (2, 3))
+        self.assertEqual(len(grouper.cache_dict), 2)
+        grouper.transform(data, iterations=1)
+        self.assertEqual((grouper.hits, grouper.misses), (2, 4))
+
+    def test_chunked_groupby_mean(self):
+        """
+        Checks that reading data in chunks gives the same result as reducing
+        it all at once, however the chunks split clusters.
+        """
+        sim = DataSimulator([[stats.norm], [stats.norm], [stats.norm]])
+        sim.fit([2, [4, 3], [2, 3, 1, 4, 2, 2, 3]])
+        data = sim.generate()
+        reduced = internal_functions.GroupbyMean().fit_transform(data)
+        for chunk_size in (1, 2, 5, 1000):
+            np.testing.assert_array_equal(
+                reduced, internal_functions.chunked_groupby_mean(data, chunk_size)
+            )
+
+        with self.assertRaises(ValueError) as raises:
+            internal_functions.chunked_groupby_mean(data[::-1], 5)
+        self.assertIn("data must be lexicographically sorted.", str(raises.exception))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import hierarch.internal_functions
 import hierarch.resampling
 from hierarch.power import DataSimulator
 import scipy.stats as stats
@@ -53,6 +54,65 @@ class TestBootstrapper(unittest.TestCase):
             test_1 = boot.transform(self.data_1, start=start)
             self.assertAlmostEqual(self.data_1[:, -1].sum(), test_1[:, -1].sum())
 
+    def test_weights(self):
+        """
+        Tests that weights() draws the same weights that transform() applies.
+        """
+        for kind in ("weights", "bayesian"):
+            boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+            boot.fit(self.data_1)
+            transformed = boot.transform(self.data_1, start=1)
+
+            boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+            boot.fit(self.data_1)
+            weights = boot.weights(start=1)
+            np.testing.assert_array_equal(
+                transformed[:, -1], self.data_1[:, -1] * weights
+            )
+
+    def test_batch(self):
+        """
+        Tests that weights_batch and transform_batch match successive calls
+        to weights and transform.
+        """
+        for kind in ("weights", "bayesian", "indexes"):
+            for skip in (None, [2]):
+                boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+                boot.fit(self.data_1, skip=skip)
+                batch = boot.weights_batch(start=1, n=5)
+                self.assertEqual(batch.shape, (5, len(self.data_1)))
+
+                boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+                boot.fit(self.data_1, skip=skip)
+                for row in batch:
+                    np.testing.assert_array_equal(row, boot.weights(start=1))
+
+                if kind == "indexes":
+                    continue
+                boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+                boot.fit(self.data_1, skip=skip)
+                batch = boot.transform_batch(self.data_1, start=1, n=5)
+
+                boot = hierarch.resampling.Bootstrapper(random_state=1, kind=kind)
+                boot.fit(self.data_1, skip=skip)
+                for row in batch:
+                    transformed = boot.transform(self.data_1, start=1)
+                    np.testing.assert_array_equal(row, transformed[:, -1])
+
+    def test_batch_stop(self):
+        """
+        Tests that weights_batch weights clusters when given a stop column.
+        """
+        boot = hierarch.resampling.Bootstrapper(random_state=1, kind="weights")
+        boot.fit(self.data_1)
+        batch = boot.weights_batch(start=0, n=5, stop=2)
+        # one weight per column 1 cluster, summing to the number of clusters
+        self.assertEqual(batch.shape, (5, 6))
+        np.testing.assert_array_equal(batch.sum(axis=1), 6)
+
+        # start == stop leaves every cluster equally weighted
+        np.testing.assert_array_equal(boot.weights_batch(1, 3, stop=1), 1)
+
     def test_bootstrapper_exceptions(self):
         with self.assertRaises(KeyError) as raises:
             boot = hierarch.resampling.Bootstrapper(kind="blah")
@@ -88,6 +148,26 @@ class TestBootstrapper(unittest.TestCase):
             boot.transform(self.data_1, start=1)
         self.assertIn("Use fit() before using transform().", str(raises.exception))
 
+        with self.assertRaises(Exception) as raises:
+            boot.weights(start=1)
+        self.assertIn("Use fit() before using weights().", str(raises.exception))
+
+        with self.assertRaises(Exception) as raises:
+            boot.weights_batch(start=1, n=5)
+        self.assertIn("Use fit() before using weights_batch().", str(raises.exception))
+
+        with self.assertRaises(Exception) as raises:
+            boot.transform_batch(self.data_1, start=1, n=5)
+        self.assertIn(
+            "Use fit() before using transform_batch().", str(raises.exception)
+        )
+
+        boot = hierarch.resampling.Bootstrapper(kind="indexes")
+        boot.fit(self.data_1)
+        with self.assertRaises(ValueError) as raises:
+            boot.transform_batch(self.data_1, start=1, n=5)
+        self.assertIn("Use weights_batch() instead.", str(raises.exception))
+
 
 class TestPermuter(unittest.TestCase):
     orig_data = np.arange(100).reshape((50, 2))
@@ -142,12 +222,92 @@ class TestPermuter(unittest.TestCase):
             for idx, v in enumerate(shuf_1[:, 0]):
                 self.assertEqual(v, self.orig_data[:, 0][idx])
 
+    def test_exact_stratified(self):
+        """
+        Test that exact within-cluster permutations visit every distinct
+        permutation once before starting over.
+        """
+        data = np.array(
+            [
+                [1, 1, 0, 0],
+                [1, 2, 1, 0],
+                [1, 2, 2, 0],
+                [2, 1, 3, 0],
+                [2, 2, 4, 0],
+                [3, 1, 5, 0],
+            ],
+            dtype=np.float64,
+        )
+
+        permuter = hierarch.resampling.Permuter()
+        permuter.fit(data, 1, exact=True)
+        self.assertEqual(permuter.n_permutations, 6)
+
+        shuf = data.copy()
+        seen = []
+        for i in range(2 * permuter.n_permutations):
+            permuter.transform(shuf)
+            seen.append(tuple(shuf[:, 1]))
+            # labels only move within their cluster
+            for cluster in (1, 2, 3):
+                in_cluster = shuf[:, 0] == cluster
+                self.assertEqual(
+                    sorted(shuf[in_cluster, 1]), sorted(data[in_cluster, 1])
+                )
+
+        self.assertEqual(len(set(seen)), permuter.n_permutations)
+        self.assertEqual(
+            seen[: permuter.n_permutations], seen[permuter.n_permutations :]
+        )
+
+    def test_hierarchy(self):
+        """
+        Test that fitting to a precomputed Hierarchy gives the same permutations.
+        """
+        data = np.array(
+            [[i // 8, i // 4, i // 2, i] for i in range(16)], dtype=np.float64
+        )
+        hierarchy = hierarch.internal_functions.Hierarchy(data)
+        for col in (0, 1):
+            for exact in (True, False):
+                permuted = []
+                for fit_hierarchy in (None, hierarchy):
+                    permuter = hierarch.resampling.Permuter(random_state=1)
+                    permuter.fit(data, col, exact=exact, hierarchy=fit_hierarchy)
+                    permuted.append([permuter.transform(data.copy()) for i in range(5)])
+                np.testing.assert_array_equal(permuted[0], permuted[1])
+
+    def test_batch(self):
+        """
+        Test that transform_batch matches successive calls to transform.
+        """
+        repeated_data = self.orig_data.repeat(2, axis=0)
+        for data in (self.orig_data, repeated_data):
+            for exact in (True, False):
+                permuter = hierarch.resampling.Permuter(random_state=1)
+                permuter.fit(data, 0, exact=exact)
+                batch = permuter.transform_batch(data, 10)
+
+                permuter = hierarch.resampling.Permuter(random_state=1)
+                permuter.fit(data, 0, exact=exact)
+                shuf = data.copy()
+                for row in batch:
+                    permuter.transform(shuf)
+                    for idx, v in enumerate(row):
+                        self.assertEqual(v, shuf[:, 0][idx])
+
     def test_permuter_exceptions(self):
         permuter = hierarch.resampling.Permuter()
         with self.assertRaises(Exception) as raises:
             permuter.transform(self.orig_data)
         self.assertIn("Use fit() before using transform().", str(raises.exception))
 
+        with self.assertRaises(Exception) as raises:
+            permuter.transform_batch(self.orig_data, 10)
+        self.assertIn(
+            "Use fit() before using transform_batch().", str(raises.exception)
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
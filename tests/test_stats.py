@@ -1,8 +1,15 @@
+import itertools
+import os
+import tempfile
 import unittest
+from fractions import Fraction
+import hierarch.internal_functions
+import hierarch.resampling
 import hierarch.stats
 from hierarch.power import DataSimulator
 import scipy.stats as stats
 import numpy as np
+import pandas as pd
 
 
 class TestPreprocessData(unittest.TestCase):
@@ -28,6 +35,36 @@ class TestPreprocessData(unittest.TestCase):
         for idx, v in enumerate(processed[:, 1]):
             self.assertEqual(v, data[:, 1][idx])
 
+    def test_labels(self):
+        """
+        Checks that encoded columns can be decoded with the returned labels
+        and that rows end up sorted.
+        """
+        data = pd.DataFrame(
+            {
+                "treatment": ["b", "a", "c", "a", "b"],
+                "dose": pd.Categorical([10, 1, 10, 1, 5]),
+                "cell": pd.Categorical(["y", "x", "x", "y", "x"]),
+                "value": [0.5, 0.1, 0.3, 0.2, 0.4],
+            }
+        )
+        processed, labels = hierarch.stats._preprocess_data(data, return_labels=True)
+        self.assertEqual(sorted(labels), [0, 2])
+        np.testing.assert_array_equal(
+            labels[0][processed[:, 0].astype(int)], ["a", "a", "b", "b", "c"]
+        )
+        np.testing.assert_array_equal(
+            labels[2][processed[:, 2].astype(int)], ["x", "y", "x", "y", "x"]
+        )
+        # numeric categories keep their values
+        np.testing.assert_array_equal(processed[:, 1], [1, 1, 5, 10, 10])
+        np.testing.assert_array_equal(processed[:, 3], [0.1, 0.2, 0.4, 0.5, 0.3])
+
+        # sorted numeric data is returned as is
+        np.testing.assert_array_equal(
+            hierarch.stats._preprocess_data(processed), processed
+        )
+
 
 class TestStudentizedCovariance(unittest.TestCase):
     def test_cov(self):
@@ -40,6 +77,19 @@ class TestStudentizedCovariance(unittest.TestCase):
             hierarch.stats.studentized_covariance(x[:, 0], x[:, 1]), 1.0039690353154482
         )
 
+    def test_batch(self):
+        """
+        Checks studentized_covariance_batch against studentized_covariance.
+        """
+        rng = np.random.default_rng(123)
+        y = rng.random(size=12)
+        X = np.array([rng.permutation(np.arange(12) // 4) for i in range(10)])
+        batch = hierarch.stats.studentized_covariance_batch(X, y)
+        for idx, x in enumerate(X):
+            self.assertAlmostEqual(
+                batch[idx], hierarch.stats.studentized_covariance(x, y)
+            )
+
 
 class TestWelch(unittest.TestCase):
     def test_welch(self):
@@ -55,6 +105,33 @@ class TestWelch(unittest.TestCase):
             stats.ttest_ind(a, b, equal_var=False)[0],
         )
 
+    def test_batch(self):
+        """
+        Checks welch_statistic_batch against welch_statistic.
+        """
+        rng = np.random.default_rng(456)
+        y = rng.random(size=12)
+        X = np.array([rng.permutation(np.arange(12) // 6) for i in range(10)])
+        batch = hierarch.stats.welch_statistic_batch(X, y, 0)
+        for idx, x in enumerate(X):
+            self.assertAlmostEqual(
+                batch[idx], hierarch.stats.welch_statistic(y[x == 0], y[x != 0])
+            )
+
+    def test_batch_ties(self):
+        """
+        Checks that welch_statistic_batch matches welch_statistic exactly on
+        discrete data, so tied permutations tie in the same way.
+        """
+        rng = np.random.default_rng(789)
+        y = rng.choice([0.1, 0.2, 0.3, 0.4], size=20)
+        X = np.array([rng.permutation(np.arange(20) // 10) for i in range(200)])
+        batch = hierarch.stats.welch_statistic_batch(X, y, 0)
+        for idx, x in enumerate(X):
+            self.assertEqual(
+                batch[idx], hierarch.stats.welch_statistic(y[x == 0], y[x != 0])
+            )
+
 
 class TestHypothesisTest(unittest.TestCase):
     import scipy.stats as stats
@@ -104,6 +181,311 @@ class TestHypothesisTest(unittest.TestCase):
         )
         self.assertAlmostEqual(corr_p, t_p)
 
+    def test_compiled_null(self):
+        """
+        Checks that the compiled resampling loop generates the same null
+        distribution as the interpreted loop used for custom statistics.
+        """
+        for compare in ("corr", "means"):
+            teststat = hierarch.stats._test_stat_factory(
+                tuple(self.data[:, 0].tolist()), compare
+            )
+            for kind in ("weights", "bayesian"):
+                compiled = hierarch.stats.hypothesis_test(
+                    self.data,
+                    0,
+                    compare=compare,
+                    bootstraps=20,
+                    permutations=50,
+                    kind=kind,
+                    return_null=True,
+                    random_state=1,
+                )
+                interpreted = hierarch.stats.hypothesis_test(
+                    self.data,
+                    0,
+                    compare=teststat,
+                    bootstraps=20,
+                    permutations=50,
+                    kind=kind,
+                    return_null=True,
+                    random_state=1,
+                )
+                self.assertEqual(compiled[0], interpreted[0])
+                self.assertEqual(compiled[1], interpreted[1])
+
+    def test_swap_null(self):
+        """
+        Checks that exact two-sample tests enumerate the same null distribution
+        as the interpreted loop, up to order.
+        """
+        for hierarchy in ([2, 4, 3], [2, [6, 3], 2]):
+            datagen = DataSimulator(self.paramlist, random_state=2)
+            datagen.fit(hierarchy)
+            data = datagen.generate()
+            for compare in ("corr", "means"):
+                teststat = hierarch.stats._test_stat_factory(
+                    tuple(data[:, 0].tolist()), compare
+                )
+                compiled = hierarch.stats.hypothesis_test(
+                    data,
+                    0,
+                    compare=compare,
+                    bootstraps=10,
+                    permutations="all",
+                    return_null=True,
+                    random_state=1,
+                )
+                interpreted = hierarch.stats.hypothesis_test(
+                    data,
+                    0,
+                    compare=teststat,
+                    bootstraps=10,
+                    permutations="all",
+                    return_null=True,
+                    random_state=1,
+                )
+                self.assertEqual(compiled[0], interpreted[0])
+                np.testing.assert_allclose(
+                    np.sort(compiled[1]), np.sort(interpreted[1]), atol=1e-12
+                )
+
+    def test_exact_ties(self):
+        """
+        Checks exact two-sample p-values on discrete data, where many
+        permutations tie with the observed one, against a brute-force
+        enumeration in exact arithmetic.
+        """
+
+        def welch_squared(sample_a, sample_b):
+            # sign(t) * t ** 2 orders permutations exactly like t
+            mean_a = sum(sample_a) / len(sample_a)
+            mean_b = sum(sample_b) / len(sample_b)
+            var_a = sum((v - mean_a) ** 2 for v in sample_a) / (len(sample_a) - 1)
+            var_b = sum((v - mean_b) ** 2 for v in sample_b) / (len(sample_b) - 1)
+            meandiff = mean_a - mean_b
+            t_squared = meandiff**2 / (var_a / len(sample_a) + var_b / len(sample_b))
+            return t_squared if meandiff >= 0 else -t_squared
+
+        rng = np.random.default_rng(3)
+        for i in range(3):
+            tenths = rng.integers(1, 5, size=12)
+            data = np.column_stack(
+                [np.repeat([1.0, 2.0], 6), np.arange(1.0, 13.0), tenths / 10]
+            )
+
+            values = [Fraction(int(v), 10) for v in tenths]
+            observed = welch_squared(values[:6], values[6:])
+            null = []
+            for chosen in itertools.combinations(range(12), 6):
+                sample_a = [values[j] for j in chosen]
+                sample_b = [values[j] for j in range(12) if j not in chosen]
+                null.append(welch_squared(sample_a, sample_b))
+            p_less = sum(v <= observed for v in null) / len(null)
+            p_greater = sum(v >= observed for v in null) / len(null)
+            expected = 2 * min(p_less, p_greater)
+
+            teststat = hierarch.stats._test_stat_factory(
+                tuple(data[:, 0].tolist()), "means"
+            )
+            for kind, compare in (
+                ("weights", "means"),
+                ("indexes", "means"),
+                ("weights", teststat),
+            ):
+                pval = hierarch.stats.hypothesis_test(
+                    data,
+                    0,
+                    compare=compare,
+                    bootstraps=1,
+                    permutations="all",
+                    kind=kind,
+                )
+                self.assertAlmostEqual(pval, expected)
+
+    def test_nested_exact(self):
+        """
+        Checks exact tests of a treatment nested within blocks.
+        """
+        rng = np.random.default_rng(0)
+        data = np.array(
+            [
+                [block, treatment, sample, rep, rng.normal() + treatment]
+                for block in range(3)
+                for treatment in range(2)
+                for sample in range(2)
+                for rep in range(2)
+            ]
+        )
+        teststat = hierarch.stats._test_stat_factory(
+            tuple(data[:, 1].tolist()), "means"
+        )
+        compiled = hierarch.stats.hypothesis_test(
+            data,
+            1,
+            compare="means",
+            bootstraps=5,
+            permutations="all",
+            return_null=True,
+            random_state=1,
+        )
+        interpreted = hierarch.stats.hypothesis_test(
+            data,
+            1,
+            compare=teststat,
+            bootstraps=5,
+            permutations="all",
+            return_null=True,
+            random_state=1,
+        )
+        # six arrangements of two treated samples in each of three blocks
+        self.assertEqual(len(compiled[1]), 5 * 6**3)
+        self.assertEqual(compiled[0], interpreted[0])
+        np.testing.assert_allclose(compiled[1], interpreted[1])
+
+    def test_auto_permutations(self):
+        """
+        Checks that permutations="auto" enumerates small permutation spaces and
+        samples large ones.
+        """
+        large = DataSimulator(self.paramlist, random_state=2)
+        large.fit([2, 8, 3])
+
+        # 70 ways to assign two treatments to 8 samples, 12,870 for 16 samples
+        for data, permutations in ((self.data, "all"), (large.generate(), 1000)):
+            auto = hierarch.stats.hypothesis_test(
+                data,
+                0,
+                compare="means",
+                bootstraps=10,
+                permutations="auto",
+                return_null=True,
+                random_state=1,
+            )
+            fixed = hierarch.stats.hypothesis_test(
+                data,
+                0,
+                compare="means",
+                bootstraps=10,
+                permutations=permutations,
+                return_null=True,
+                random_state=1,
+            )
+            self.assertEqual(auto, fixed)
+
+    def test_sequential(self):
+        """
+        Checks that sequential testing stops early when the p-value is far
+        from alpha and is consistent with a full test.
+        """
+        first = hierarch.stats.hypothesis_test(
+            self.data, 0, bootstraps=1, permutations=50, random_state=1
+        )
+
+        pval, used, std_error = hierarch.stats.hypothesis_test(
+            self.data, 0, bootstraps=20, permutations=50, random_state=1, alpha=0.5
+        )
+        self.assertEqual(used, 50)
+        self.assertEqual(pval, first)
+        self.assertGreater(abs(pval - 0.5), 3 * std_error)
+
+        # resampling stops after a power of two bootstraps with the same
+        # p-value as a full test with that many bootstraps
+        pval, used, std_error = hierarch.stats.hypothesis_test(
+            self.data, 0, bootstraps=20, permutations=50, random_state=1, alpha=0.02
+        )
+        self.assertIn(used, (50, 100, 200, 400, 800, 1000))
+        self.assertEqual(
+            pval,
+            hierarch.stats.hypothesis_test(
+                self.data, 0, bootstraps=used // 50, permutations=50, random_state=1
+            ),
+        )
+
+    def test_parallel_null(self):
+        """
+        Checks that parallel null distributions are reproducible.
+        """
+        for n_jobs in (1, 3):
+            nulls = [
+                hierarch.stats.hypothesis_test(
+                    self.data,
+                    0,
+                    bootstraps=20,
+                    permutations=50,
+                    return_null=True,
+                    random_state=1,
+                    n_jobs=n_jobs,
+                )[1]
+                for i in range(2)
+            ]
+            self.assertEqual(len(nulls[0]), 1000)
+            self.assertEqual(nulls[0], nulls[1])
+
+    def test_skip_lowest(self):
+        """
+        Checks that averaging over a skipped lowest level once, before
+        resampling, gives the same bootstrapped samples as aggregating every
+        resampled copy of the full data.
+        """
+        datagen = DataSimulator(self.paramlist + [[stats.norm]], random_state=2)
+        datagen.fit([2, 3, 2, 3])
+        data = datagen.generate()
+        collapsed, skip, hierarchy = hierarch.stats._collapse_skipped(
+            data, 0, [3], None
+        )
+        self.assertEqual(skip, [])
+        self.assertEqual(collapsed.shape, (12, 4))
+
+        for kind in ("weights", "bayesian", "indexes"):
+            samples = []
+            for target, target_skip, iterations in ((data, [3], 2), (collapsed, [], 1)):
+                bootstrapper = hierarch.resampling.Bootstrapper(
+                    random_state=1, kind=kind
+                )
+                bootstrapper.fit(target, skip=target_skip)
+                aggregator = hierarch.internal_functions.GroupbyMean()
+                aggregator.fit(target)
+                for i in range(20):
+                    if kind == "indexes":
+                        weights = bootstrapper.weights(start=2)
+                        resampled = target[
+                            hierarch.internal_functions.weights_to_index(weights)
+                        ]
+                    else:
+                        weights = None
+                        resampled = bootstrapper.transform(target, start=2)
+                    samples.append(
+                        aggregator.transform(
+                            resampled, iterations=iterations, weights=weights
+                        )
+                    )
+            # the mean of weighted values and the weighted mean only agree to
+            # rounding error
+            np.testing.assert_allclose(samples[:20], samples[20:], rtol=1e-12)
+
+    def test_memmap(self):
+        """
+        Checks that testing a memory-mapped array, which is aggregated in
+        chunks if its final column is skipped, matches testing it in memory.
+        """
+        datagen = DataSimulator(self.paramlist + [[stats.norm]], random_state=2)
+        datagen.fit([2, 3, 2, 3])
+        data = datagen.generate()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "data.npy")
+            np.save(path, data)
+            memmap = np.load(path, mmap_mode="r")
+            for skip in (None, [3]):
+                in_memory = hierarch.stats.hypothesis_test(
+                    data, 0, skip=skip, bootstraps=20, random_state=1
+                )
+                on_disk = hierarch.stats.hypothesis_test(
+                    memmap, 0, skip=skip, bootstraps=20, random_state=1
+                )
+                self.assertEqual(in_memory, on_disk)
+            del memmap
+
     def test_hypothesis_exceptions(self):
         with self.assertRaises(TypeError) as raises:
             hierarch.stats.hypothesis_test("ah", 0)
@@ -125,17 +507,53 @@ class TestHypothesisTest(unittest.TestCase):
         with self.assertRaises(TypeError) as raises:
             hierarch.stats.hypothesis_test(self.data, 0, permutations="a")
         self.assertIn(
-            "permutations must be 'all' or an integer greater than 0",
+            "permutations must be 'all', 'auto' or an integer greater than 0",
             str(raises.exception),
         )
 
         with self.assertRaises(TypeError) as raises:
             hierarch.stats.hypothesis_test(self.data, 0, permutations=1.5)
         self.assertIn(
-            "permutations must be 'all' or an integer greater than 0",
+            "permutations must be 'all', 'auto' or an integer greater than 0",
             str(raises.exception),
         )
 
+        with self.assertRaises(TypeError) as raises:
+            hierarch.stats.hypothesis_test(self.data, 0, n_jobs=0)
+        self.assertIn(
+            "n_jobs must be -1 or an integer greater than 0", str(raises.exception)
+        )
+
+        with self.assertWarns(Warning) as warning:
+            hierarch.stats.hypothesis_test(self.data, 0, kind="indexes", n_jobs=2)
+        self.assertIn(
+            "n_jobs is not supported for this test. Running serially.",
+            str(warning.warning),
+        )
+
+        with self.assertWarns(Warning) as warning:
+            hierarch.stats.hypothesis_test(self.data, 0, n_jobs=2, alpha=0.05)
+        self.assertIn(
+            "n_jobs is not supported for this test. Running serially.",
+            str(warning.warning),
+        )
+
+        for alpha in (0, 1.5):
+            with self.assertRaises(ValueError) as raises:
+                hierarch.stats.hypothesis_test(self.data, 0, alpha=alpha)
+            self.assertIn("alpha must be between 0 and 1.", str(raises.exception))
+
+        with self.assertRaises(ValueError) as raises:
+            hierarch.stats.hypothesis_test(self.data, 0, alpha=0.05, tolerance=0)
+        self.assertIn("tolerance must be between 0 and 1.", str(raises.exception))
+
+        hierarchy = hierarch.internal_functions.Hierarchy(self.data[:-1])
+        with self.assertRaises(ValueError) as raises:
+            hierarch.stats.hypothesis_test(self.data, 0, hierarchy=hierarchy)
+        self.assertIn(
+            "hierarchy does not match the preprocessed data.", str(raises.exception)
+        )
+
         with self.assertRaises(AttributeError) as raises:
             hello = 5
             hierarch.stats.hypothesis_test(self.data, 0, compare=hello)
@@ -166,6 +584,173 @@ class TestMultiTest(unittest.TestCase):
         out = hierarch.stats.multi_sample_test(self.data, 0).to_numpy()
         self.assertEqual(len(out), 6)
 
+    def test_shared_resamples(self):
+        """
+        Tests that sharing resamples between comparisons tests the same
+        hypotheses as testing each pair separately.
+        """
+        kwargs = dict(correction=None, bootstraps=50, permutations="all")
+        separate = hierarch.stats.multi_sample_test(
+            self.data, 0, random_state=1, **kwargs
+        )
+        shared = hierarch.stats.multi_sample_test(
+            self.data, 0, random_state=1, shared_resamples=True, **kwargs
+        )
+        separate = separate.sort_values(["Condition 1", "Condition 2"]).to_numpy()
+        shared = shared.sort_values(["Condition 1", "Condition 2"]).to_numpy()
+        np.testing.assert_array_equal(shared[:, :2], separate[:, :2])
+        np.testing.assert_allclose(
+            shared[:, 2].astype(float), separate[:, 2].astype(float), atol=0.02
+        )
+
+        # labels are translated to the encoding of the full dataset
+        labeled = self.data.astype(object)
+        labeled[:, 0] = np.array(["a", "b", "c", "d"])[self.data[:, 0].astype(int) - 1]
+        out = hierarch.stats.multi_sample_test(
+            labeled,
+            0,
+            hypotheses=[["b", "a"], ["d", "c"]],
+            random_state=1,
+            shared_resamples=True,
+            **kwargs
+        ).to_numpy()
+        self.assertEqual(sorted(map(tuple, out[:, :2])), [("b", "a"), ("d", "c")])
+        for (a, b), pval in zip(out[:, :2], out[:, 2]):
+            condition_1, condition_2 = "abcd".index(a) + 1.0, "abcd".index(b) + 1.0
+            (expected,) = shared[
+                (shared[:, 0] == min(condition_1, condition_2))
+                & (shared[:, 1] == max(condition_1, condition_2)),
+                2,
+            ]
+            self.assertAlmostEqual(pval, expected, delta=0.02)
+
+    def test_max_t(self):
+        """
+        Tests that max-T adjusts p-values upwards and that the adjusted
+        p-values increase down the output.
+        """
+        out = hierarch.stats.multi_sample_test(
+            self.data, 0, correction="maxt", bootstraps=20, random_state=1
+        ).to_numpy()
+        pvals, adjusted = out[:, 2].astype(float), out[:, 3].astype(float)
+        self.assertTrue(np.all(adjusted >= pvals))
+        self.assertTrue(np.all(adjusted <= 1))
+        self.assertTrue(np.all(np.diff(adjusted) >= 0))
+
+        # conditions 1 and 4 differ by 6
+        in_row = (out[:, 0] == 1.0) & (out[:, 1] == 4.0)
+        self.assertLess(adjusted[in_row][0], 0.05)
+
+        # there are too many relabellings of these 16 units to enumerate
+        kwargs = dict(bootstraps=5, random_state=1, correction="maxt")
+        auto = hierarch.stats.multi_sample_test(
+            self.data, 0, permutations="auto", **kwargs
+        )
+        random = hierarch.stats.multi_sample_test(
+            self.data, 0, permutations=1000, **kwargs
+        )
+        np.testing.assert_array_equal(auto.to_numpy(), random.to_numpy())
+
+        # a single comparison is not adjusted, and with every relabelling of
+        # its units, it is the exact two-sample test
+        out = hierarch.stats.multi_sample_test(
+            self.data,
+            0,
+            hypotheses=[[1.0, 2.0]],
+            correction="maxt",
+            bootstraps=1,
+            permutations="all",
+        ).to_numpy()
+        in_pair = np.isin(self.data[:, 0], (1.0, 2.0))
+        exact = hierarch.stats.hypothesis_test(
+            self.data[in_pair], 0, bootstraps=1, permutations="all"
+        )
+        self.assertAlmostEqual(out[0, 2], exact)
+        self.assertAlmostEqual(out[0, 3], exact)
+
+    def test_max_t_correlated(self):
+        """
+        Tests that max-T is less conservative than Holm's procedure when the
+        comparisons are strongly correlated, as they are when many treatments
+        are compared to a small control.
+        """
+        rng = np.random.default_rng(3)
+        rows = []
+        for condition, n_units, shift in [(0, 3, 0.0)] + [
+            (c, 8, 2.0) for c in range(1, 6)
+        ]:
+            for unit in range(n_units):
+                mean = shift + rng.normal()
+                for rep in range(2):
+                    rows.append((condition, unit, rep, mean + 0.2 * rng.normal()))
+        data = np.array(rows)
+        pairs = [(0.0, float(c)) for c in range(1, 6)]
+
+        # every comparison in a resample shares the relabelled control
+        _, nulls = hierarch.stats._joint_pairwise_nulls(
+            data, 0, pairs, "means", None, 5, 1000, "weights", 1
+        )
+        correlation = np.corrcoef(nulls.T)[np.triu_indices(len(pairs), 1)]
+        self.assertTrue(np.all(correlation > 0.5))
+
+        out = hierarch.stats.multi_sample_test(
+            data,
+            0,
+            hypotheses=[list(pair) for pair in pairs],
+            correction="maxt",
+            bootstraps=10,
+            random_state=1,
+        ).to_numpy()
+        pvals, adjusted = out[:, 2].astype(float), out[:, 3].astype(float)
+        holm = min(1, len(pvals) * pvals.min())
+        self.assertLess(adjusted.min(), 0.8 * holm)
+
+    def test_max_t_adjust(self):
+        """
+        Tests the step-down against Westfall-Young adjusted p-values worked out
+        by hand.
+        """
+        null = np.array(
+            [
+                [1.0, 0.5, 2.5],
+                [4.0, 0.2, 0.1],
+                [0.5, 1.5, 0.3],
+                [2.0, 0.9, 2.1],
+                [0.1, 0.1, 0.1],
+            ]
+        )
+        # comparison 0 is compared to the maximum of every column, comparison
+        # 2 to the maximum of columns 1 and 2, and comparison 1 to column 1,
+        # giving 1/5, 2/5 and 1/5. comparison 1 is less significant than
+        # comparison 2, so its p-value is raised to 2/5
+        adjusted = hierarch.stats._max_t_adjust(null, np.array([3.0, 1.0, 2.0]))
+        np.testing.assert_allclose(adjusted, [0.2, 0.4, 0.4])
+
+        # a statistic beyond every null statistic still gets a p-value of 1/5
+        adjusted = hierarch.stats._max_t_adjust(null, np.array([5.0, 1.0, 2.0]))
+        np.testing.assert_allclose(adjusted, [0.2, 0.4, 0.4])
+
+        # with the order of the last two reversed, comparison 1 is compared to
+        # the maximum of columns 1 and 2 and comparison 2 to column 2 alone
+        adjusted = hierarch.stats._max_t_adjust(null, np.array([3.0, 2.0, 0.2]))
+        np.testing.assert_allclose(adjusted, [0.2, 0.4, 0.6])
+
+        # a single comparison is not adjusted
+        adjusted = hierarch.stats._max_t_adjust(null[:, :1], np.array([1.0]))
+        np.testing.assert_allclose(adjusted, [0.6])
+
+        # null statistics that tie with an observed statistic up to rounding
+        # error count as at least as extreme
+        adjusted = hierarch.stats._max_t_adjust(null[:, :1], np.array([2.0 + 1e-14]))
+        np.testing.assert_allclose(adjusted, [0.4])
+
+        # adjusted p-values are never less than the unadjusted ones, and
+        # still increase from the largest observed statistic down
+        adjusted = hierarch.stats._max_t_adjust(
+            null, np.array([3.0, 1.0, 2.0]), np.array([0.3, 0.2, 0.1])
+        )
+        np.testing.assert_allclose(adjusted, [0.3, 0.4, 0.4])
+
     def test_fdr_adjustment(self):
         p_vals = np.arange(0.05, 1.05, step=0.1)
         adjusted = hierarch.stats._false_discovery_adjust(p_vals)
@@ -204,6 +789,122 @@ class TestConfidenceInterval(unittest.TestCase):
         self.assertLess(interval_95[0], interval_68[0])
         self.assertGreater(interval_95[1], interval_68[1])
 
+    def test_bound_search(self):
+        """
+        Tests the bound searches, running them concurrently and reporting the
+        number of null distributions evaluated.
+        """
+        kwargs = dict(bootstraps=20, permutations=50, random_state=1)
+        for method in ("manly", "secant"):
+            interval, evaluations = hierarch.stats.confidence_interval(
+                self.data, 0, method=method, return_evaluations=True, **kwargs
+            )
+            self.assertLess(interval[0], interval[1])
+            for n in evaluations:
+                self.assertGreaterEqual(n, 1)
+                self.assertLessEqual(n, 7)
+
+            # the searches are deterministic, so threads change nothing
+            concurrent = hierarch.stats.confidence_interval(
+                self.data, 0, method=method, n_jobs=2, **kwargs
+            )
+            self.assertEqual(interval, concurrent)
+
+        # a custom search is given the starting guess and the target p-value
+        calls = []
+
+        def first_guess(evaluate, start, alpha, tolerance, iterations):
+            calls.append(alpha)
+            return start, evaluate(start)[0]
+
+        with self.assertWarns(hierarch.stats.ConvergenceWarning):
+            interval, evaluations = hierarch.stats.confidence_interval(
+                self.data,
+                0,
+                tolerance=0,
+                method=first_guess,
+                return_evaluations=True,
+                **kwargs
+            )
+        self.assertEqual(calls, [0.025, 0.025])
+        self.assertEqual(evaluations, (1, 1))
+
+        with self.assertRaises(KeyError) as raises:
+            hierarch.stats.confidence_interval(self.data, 0, method="blah", **kwargs)
+        self.assertIn("No such bound search.", str(raises.exception))
+
+        with self.assertRaises(TypeError) as raises:
+            hierarch.stats.confidence_interval(self.data, 0, n_jobs=0, **kwargs)
+        self.assertIn("n_jobs must be -1", str(raises.exception))
+
+    def test_confidence_curve(self):
+        """
+        Tests that the p-value function matches the hypothesis test at 0 and
+        gives nested intervals.
+        """
+        kwargs = dict(bootstraps=20, permutations=50, kind="weights", random_state=1)
+        _, pval = hierarch.stats.confidence_curve(self.data, 0, shifts=[0.0], **kwargs)
+        self.assertAlmostEqual(
+            pval[0], hierarch.stats.hypothesis_test(self.data, 0, **kwargs)
+        )
+
+        shifts, pvals = hierarch.stats.confidence_curve(self.data, 0, **kwargs)
+        self.assertEqual(shifts.shape, (101,))
+        self.assertEqual(pvals.shape, (101,))
+        self.assertTrue(np.all(np.diff(shifts) > 0))
+
+        accepted_95 = shifts[pvals > 0.05]
+        accepted_68 = shifts[pvals > 0.32]
+        self.assertLessEqual(accepted_95.min(), accepted_68.min())
+        self.assertGreaterEqual(accepted_95.max(), accepted_68.max())
+
+        for shifts in (1, [[0.0]]):
+            with self.assertRaises(TypeError) as raises:
+                hierarch.stats.confidence_curve(self.data, 0, shifts=shifts, **kwargs)
+            self.assertIn("shifts must be an integer", str(raises.exception))
+
+    def test_shifted_null(self):
+        """
+        Tests that shifting stored resamples matches resampling shifted data.
+        """
+        hierarchy = hierarch.internal_functions.Hierarchy(self.data)
+        labels = tuple(np.unique(self.data[:, 0]).tolist())
+        batch_stat = hierarch.stats._batch_stat_factory(labels, "corr")
+        shifted_data = self.data.copy()
+        shifted_data[:, -1] += 1.5 * shifted_data[:, 0]
+
+        for kind in ("weights", "bayesian", "indexes"):
+            # without a shift, the null distribution is the hypothesis test's
+            _, null = hierarch.stats.hypothesis_test(
+                self.data,
+                0,
+                bootstraps=20,
+                permutations=30,
+                kind=kind,
+                return_null=True,
+                random_state=1,
+            )
+            resamples = hierarch.stats._shift_resamples(
+                self.data, 0, None, 20, 30, kind, 1, hierarchy
+            )
+            _, _, shifted_null = hierarch.stats._shifted_null(
+                resamples, batch_stat, 0, 0.0
+            )
+            np.testing.assert_array_equal(null, shifted_null)
+
+            # shifting the stored resamples is the same as resampling shifted data
+            _, truediff, shifted_null = hierarch.stats._shifted_null(
+                resamples, batch_stat, 0, 1.5
+            )
+            resamples = hierarch.stats._shift_resamples(
+                shifted_data, 0, None, 20, 30, kind, 1, hierarchy
+            )
+            _, expected_truediff, expected_null = hierarch.stats._shifted_null(
+                resamples, batch_stat, 0, 0.0
+            )
+            self.assertAlmostEqual(truediff, expected_truediff)
+            np.testing.assert_allclose(shifted_null, expected_null)
+
 
 class TestHierarchicalRandomization(unittest.TestCase):
     paramlist = [[0, 2], [stats.norm], [stats.norm]]
@@ -216,6 +917,68 @@ class TestHierarchicalRandomization(unittest.TestCase):
         for indices in hierarch.stats.hierarchical_randomization(self.data, 0):
             self.assertEqual(len(indices), len(self.data))
 
+    def test_output(self):
+        """
+        Checks that reusing buffers or yielding only the permuted column gives
+        the same samples as yielding each permuted dataset.
+        """
+        samples = {}
+        for output in ("data", "buffer", "column"):
+            samples[output] = []
+            for sample in hierarch.stats.hierarchical_randomization(
+                self.data,
+                0,
+                bootstraps=5,
+                permutations=10,
+                random_state=1,
+                output=output,
+            ):
+                if output == "column":
+                    sample, column = sample
+                    sample = sample.copy()
+                    sample[:, 0] = column
+                samples[output].append(sample.copy())
+
+        for output in ("buffer", "column"):
+            np.testing.assert_array_equal(samples["data"], samples[output])
+
+        # treatment labels are permuted between whole units of column 1
+        for sample, column in hierarch.stats.hierarchical_randomization(
+            self.data, 0, bootstraps=2, permutations=5, output="column"
+        ):
+            units = np.unique(sample[:, :2], axis=0, return_inverse=True)[1]
+            labels = np.unique(np.stack((units, column), axis=1), axis=0)
+            self.assertEqual(len(labels), 8)
+            self.assertEqual(np.count_nonzero(labels[:, 1] == 1), 4)
+
+        with self.assertRaises(KeyError) as raises:
+            next(hierarch.stats.hierarchical_randomization(self.data, 0, output="x"))
+        self.assertIn("Invalid 'output' argument.", str(raises.exception))
+
+    def test_validation(self):
+        """
+        Checks that bad arguments are rejected with the same messages as in
+        hypothesis_test.
+        """
+        for kwargs in (
+            {"bootstraps": 0},
+            {"bootstraps": 1.5},
+            {"permutations": "some"},
+            {"permutations": 0},
+        ):
+            with self.assertRaises(TypeError) as expected:
+                hierarch.stats.hypothesis_test(self.data, 0, **kwargs)
+            with self.assertRaises(TypeError) as raises:
+                next(hierarch.stats.hierarchical_randomization(self.data, 0, **kwargs))
+            self.assertEqual(str(raises.exception), str(expected.exception))
+
+        with self.assertWarns(UserWarning) as warns:
+            sample = next(
+                hierarch.stats.hierarchical_randomization(self.data, 0, skip=[1, 2])
+            )
+        self.assertIn("No need to include columns before", str(warns.warning))
+        self.assertEqual(sample.shape, self.data.shape)
+
 
 if __name__ == "__main__":
     unittest.main()